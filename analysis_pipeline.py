@@ -0,0 +1,257 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+
+import numpy as np
+import requests
+from PIL import Image
+
+from black_image_detector import is_single_color_array
+
+# Marks the end of the work stream on a stage queue
+_STOP = object()
+
+@dataclass
+class PipelineConfig:
+    """Concurrency and queue settings for each stage of the analysis pipeline"""
+    fetch_workers: int = 8
+    decode_workers: int = max(1, (os.cpu_count() or 2) - 1)
+    llm_workers: int = 8
+    # Results are written into a shared DataFrame, so keep a single writer
+    write_workers: int = 1
+    queue_size: int = 32
+    max_retries: int = 3
+    fetch_timeout: int = 10
+    report_interval: float = 5.0
+
+@dataclass
+class PipelineJob:
+    """One image row moving through the pipeline"""
+    key: object
+    question: str
+    image_url: str = None
+    prompt: str = None
+    content: bytes = None
+    is_multi_color: bool = None
+    result: dict = None
+    deferred: bool = False
+    timings: dict = field(default_factory=dict)
+
+def fetch_image_bytes(image_url, timeout=10):
+    """Download an image, raising requests exceptions for HTTP errors"""
+    response = requests.get(image_url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+def check_image_bytes(content):
+    """
+    Decode an image and run the single color check. Runs inside the process pool,
+    so it only takes and returns picklable values.
+
+    Returns:
+        bool: True if image is not a single color, False if it is a single color
+    """
+    img = Image.open(BytesIO(content))
+    img_array = np.array(img)
+    return bool(is_single_color_array(img_array))
+
+class AnalysisPipeline:
+    """
+    Runs image rows through four bounded stages:
+    fetch (threads) -> decode/quality check (process pool) -> LLM call (async) -> result writing.
+
+    Full queues block the upstream stage, so a slow LLM stage throttles downloads
+    instead of buffering every image in memory.
+
+    Args:
+        analyze (coroutine function): Called with a checked PipelineJob, returns the result dict
+        write_result (callable): Called with each finished PipelineJob, runs in a writer thread
+        failure_result (callable): Called with (stage, max_retries, error), returns the result dict
+            recorded for a job that failed in that stage
+        config (PipelineConfig): Stage concurrency and queue settings
+        should_stop (callable): Optional check for a run budget; once it returns True no new
+            jobs are fed or sent to the LLM, and in-flight jobs finish normally
+        can_start (callable): Optional check that an LLM call may start now; while it
+            returns False, LLM workers wait instead of starting calls
+    """
+
+    def __init__(self, analyze, write_result, failure_result, config=None, should_stop=None, can_start=None):
+        self.analyze = analyze
+        self.write_result = write_result
+        self.failure_result = failure_result
+        self.config = config or PipelineConfig()
+        self.should_stop = should_stop or (lambda: False)
+        self.can_start = can_start or (lambda: True)
+        self.stats = {}
+
+    def run(self, jobs):
+        """
+        Process all jobs and return per-stage statistics.
+
+        jobs may be a list or an async iterator; an async iterator lets a long-lived run
+        take in work as it arrives while the stage pools stay up.
+        """
+        return asyncio.run(self._run(jobs))
+
+    async def _run(self, jobs):
+        config = self.config
+        self.queues = {
+            'fetch': asyncio.Queue(maxsize=config.queue_size),
+            'decode': asyncio.Queue(maxsize=config.queue_size),
+            'llm': asyncio.Queue(maxsize=config.queue_size),
+            'write': asyncio.Queue(maxsize=config.queue_size),
+        }
+        self.stats = {
+            'processed': {stage: 0 for stage in self.queues},
+            'failed': {stage: 0 for stage in self.queues},
+            'max_queue_depth': {stage: 0 for stage in self.queues},
+            'deferred': 0,
+        }
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=config.fetch_workers) as fetch_pool, \
+                ProcessPoolExecutor(max_workers=config.decode_workers) as decode_pool, \
+                ThreadPoolExecutor(max_workers=config.write_workers) as write_pool:
+            self.fetch_pool = fetch_pool
+            self.decode_pool = decode_pool
+            self.write_pool = write_pool
+
+            reporter = asyncio.create_task(self._report_queue_depths())
+            stages = [
+                self._stage('fetch', 'decode', config.fetch_workers, config.decode_workers, self._fetch),
+                self._stage('decode', 'llm', config.decode_workers, config.llm_workers, self._decode),
+                self._stage('llm', 'write', config.llm_workers, config.write_workers, self._call_llm),
+                self._stage('write', None, config.write_workers, 0, self._write),
+            ]
+            await asyncio.gather(self._feed(jobs), *stages)
+            reporter.cancel()
+
+        self.stats['elapsed_seconds'] = round(time.monotonic() - started, 2)
+        self._print_report("Final")
+        return self.stats
+
+    async def _feed(self, jobs):
+        if hasattr(jobs, '__aiter__'):
+            async for job in jobs:
+                await self._feed_one(job)
+        else:
+            for job in jobs:
+                await self._feed_one(job)
+        for _ in range(self.config.fetch_workers):
+            await self.queues['fetch'].put(_STOP)
+
+    async def _feed_one(self, job):
+        # Rows resolved before any network work go straight to the writer
+        if job.result is not None:
+            await self._put('write', job)
+        elif self.should_stop():
+            self.stats['deferred'] += 1
+        else:
+            await self._put('fetch', job)
+
+    async def _put(self, stage, job):
+        queue = self.queues[stage]
+        await queue.put(job)
+        depth = queue.qsize()
+        if depth > self.stats['max_queue_depth'][stage]:
+            self.stats['max_queue_depth'][stage] = depth
+
+    async def _stage(self, name, next_name, workers, next_workers, handler):
+        async def worker():
+            queue = self.queues[name]
+            while True:
+                job = await queue.get()
+                if job is _STOP:
+                    return
+                started = time.monotonic()
+                await handler(job)
+                job.timings[name] = round(time.monotonic() - started, 3)
+                self.stats['processed'][name] += 1
+                if job.deferred:
+                    self.stats['deferred'] += 1
+                    continue
+                if next_name is not None:
+                    # Failed jobs skip the remaining work and are only written
+                    target = 'write' if job.result is not None else next_name
+                    await self._put(target, job)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if next_name is not None:
+            for _ in range(next_workers):
+                await self.queues[next_name].put(_STOP)
+
+    async def _fetch(self, job):
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, self.config.max_retries + 1):
+            try:
+                job.content = await loop.run_in_executor(
+                    self.fetch_pool, fetch_image_bytes, job.image_url, self.config.fetch_timeout)
+                return
+            except requests.exceptions.RequestException as e:
+                print(f"Error accessing image {job.image_url}: {e}")
+                if attempt < self.config.max_retries:
+                    await asyncio.sleep(2**attempt)  # Exponential backoff
+                else:
+                    self.stats['failed']['fetch'] += 1
+                    job.result = self.failure_result('fetch', self.config.max_retries, e)
+
+    async def _decode(self, job):
+        loop = asyncio.get_running_loop()
+        try:
+            job.is_multi_color = await loop.run_in_executor(self.decode_pool, check_image_bytes, job.content)
+        except Exception as e:
+            print(f"Error decoding image {job.image_url}: {e}")
+            self.stats['failed']['decode'] += 1
+            job.result = self.failure_result('decode', 1, e)
+        finally:
+            # The LLM is given the URL, so the downloaded bytes are no longer needed
+            job.content = None
+
+    async def _call_llm(self, job):
+        for attempt in range(1, self.config.max_retries + 1):
+            # Checked before every attempt so retries don't start calls past the budget
+            if not await self._wait_to_start():
+                job.deferred = True
+                return
+            try:
+                # analyze runs up to its first await right away, so nothing else can start
+                # a call between the check above and the call taking its share of the budget
+                job.result = await self.analyze(job)
+                return
+            except Exception as e:
+                print(f"Error during analysis: {e}")
+                if attempt < self.config.max_retries:
+                    await asyncio.sleep(2**attempt)  # Exponential backoff
+                else:
+                    self.stats['failed']['llm'] += 1
+                    job.result = self.failure_result('llm', self.config.max_retries, e)
+
+    async def _wait_to_start(self):
+        """Wait until an LLM call may start; returns False once the run should stop"""
+        while not self.should_stop():
+            if self.can_start():
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def _write(self, job):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.write_pool, self.write_result, job)
+        except Exception as e:
+            print(f"Error writing result for {job.key}: {e}")
+            self.stats['failed']['write'] += 1
+
+    async def _report_queue_depths(self):
+        while True:
+            await asyncio.sleep(self.config.report_interval)
+            self._print_report("Pipeline")
+
+    def _print_report(self, label):
+        depths = ", ".join(f"{stage}={queue.qsize()}" for stage, queue in self.queues.items())
+        processed = ", ".join(f"{stage}={count}" for stage, count in self.stats['processed'].items())
+        max_depths = ", ".join(f"{stage}={depth}" for stage, depth in self.stats['max_queue_depth'].items())
+        print(f"[{label}] queue depths: {depths} (max: {max_depths}) | processed: {processed} | deferred: {self.stats['deferred']}")
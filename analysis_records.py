@@ -0,0 +1,125 @@
+import datetime
+from dataclasses import dataclass
+
+import pandas as pd
+
+# Allowed values for the enum-like fields of an analysis result
+COMPLIANCE_VALUES = ["Yes", "No", "Unable to determine", "Error"]
+SEVERITY_VALUES = ["Critical", "Major", "Minor", "None", "Unknown"]
+
+# Result columns added to the analyzed DataFrame, in output order
+RESULT_COLUMNS = [
+    'compliance_status',
+    'explanation',
+    'improvement_suggestions',
+    'severity_level',
+    'image_quality_issues',
+    'quality_assessment',
+    'analysis_tags',
+    'analysis_date',
+]
+
+def _as_text(value, field_name):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        # Some answers come back as bullet lists instead of a paragraph
+        return ' '.join(str(item) for item in value)
+    if not isinstance(value, str):
+        raise ValueError(f"'{field_name}' must be a string, got {type(value).__name__}")
+    return value.strip()
+
+def _as_str_list(value, field_name, default):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f"'{field_name}' must be a list of strings, got {type(value).__name__}")
+    items = tuple(str(item).strip() for item in value if str(item).strip())
+    return items or default
+
+def _as_choice(value, field_name, choices):
+    if not isinstance(value, str):
+        raise ValueError(f"'{field_name}' is missing or not a string")
+    for choice in choices:
+        if value.strip().lower() == choice.lower():
+            return choice
+    raise ValueError(f"'{field_name}' must be one of {choices}, got '{value}'")
+
+def validate_model_result(result):
+    """
+    Check a parsed model response against the analysis result schema.
+
+    Args:
+        result (dict): Parsed JSON returned by the model
+
+    Returns:
+        dict: The result with enum fields normalised and list fields as tuples
+
+    Raises:
+        ValueError: If the result is not an object or a field has the wrong type or value
+    """
+    if not isinstance(result, dict):
+        raise ValueError(f"Analysis result must be a JSON object, got {type(result).__name__}")
+    return {
+        "criteria_met": _as_choice(result.get("criteria_met"), "criteria_met", COMPLIANCE_VALUES),
+        "explanation": _as_text(result.get("explanation"), "explanation"),
+        "improvements": _as_text(result.get("improvements"), "improvements"),
+        # Compliant answers often come back with "severity": null
+        "severity": _as_choice(result.get("severity") or "Unknown", "severity", SEVERITY_VALUES),
+        "image_quality_issues": _as_str_list(result.get("image_quality_issues"), "image_quality_issues", ("none",)),
+        "quality_assessment": _as_text(result.get("quality_assessment"), "quality_assessment"),
+        "tags": _as_str_list(result.get("tags"), "tags", ("untagged",)),
+    }
+
+@dataclass(slots=True)
+class AnalysisRecord:
+    """Validated analysis result for one checklist row"""
+    criteria_met: str
+    explanation: str
+    improvements: str
+    severity: str
+    image_quality_issues: tuple
+    quality_assessment: str
+    tags: tuple
+    analysis_date: str
+
+    @classmethod
+    def from_result(cls, result, analysis_date=None):
+        """Build a record from a model or fallback result dict, validating it first"""
+        validated = validate_model_result(result)
+        return cls(
+            analysis_date=analysis_date or datetime.datetime.now().strftime("%Y-%m-%d"),
+            **validated,
+        )
+
+def records_to_frame(records):
+    """
+    Assemble analysis records into result columns in one step.
+
+    Args:
+        records (dict): Mapping of DataFrame index label to AnalysisRecord
+
+    Returns:
+        pd.DataFrame: Result columns indexed by the same labels, with categorical
+            compliance_status and severity_level
+    """
+    index = pd.Index(list(records.keys()))
+    values = list(records.values())
+    frame = pd.DataFrame({
+        'compliance_status': pd.Categorical([r.criteria_met for r in values], categories=COMPLIANCE_VALUES),
+        'explanation': [r.explanation for r in values],
+        'improvement_suggestions': [r.improvements for r in values],
+        'severity_level': pd.Categorical([r.severity for r in values], categories=SEVERITY_VALUES),
+        'image_quality_issues': pd.Series([r.image_quality_issues for r in values], index=index, dtype=object).str.join(', '),
+        'quality_assessment': [r.quality_assessment for r in values],
+        'analysis_tags': pd.Series([r.tags for r in values], index=index, dtype=object).str.join(', '),
+        'analysis_date': [r.analysis_date for r in values],
+    }, index=index)
+    return frame[RESULT_COLUMNS]
+
+def apply_records(df, records):
+    """Return a copy of df with the result columns filled from records (missing rows are NaN)"""
+    results = records_to_frame(records).reindex(df.index)
+    return pd.concat([df.drop(columns=RESULT_COLUMNS, errors='ignore'), results], axis=1)
@@ -0,0 +1,183 @@
+import datetime
+import glob
+import re
+import time
+
+import pandas as pd
+
+# Categories treated as Critical-prone when there is no result history to learn from
+DEFAULT_CRITICAL_CATEGORIES = ["Food Safety Compliance"]
+
+# Rough cost of one GPT-4o image analysis call in USD, used until actual usage is tracked
+DEFAULT_COST_PER_CALL = 0.005
+
+# GPT-4o list prices in USD per token
+INPUT_TOKEN_PRICE = 2.50 / 1_000_000
+OUTPUT_TOKEN_PRICE = 10.00 / 1_000_000
+
+def usage_cost(usage):
+    """Cost in USD of one chat completion from its usage field, or None if usage is missing"""
+    if usage is None:
+        return None
+    prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', None) or 0
+    return prompt_tokens * INPUT_TOKEN_PRICE + completion_tokens * OUTPUT_TOKEN_PRICE
+
+def split_categories(categorization):
+    """Split a categorization column like '[Hygiene & Cleanliness, Food Safety Compliance]' into lists"""
+    return (
+        categorization.fillna('').astype(str)
+        .str.strip('[]"\' ')
+        .str.split(',')
+        .apply(lambda cats: [c.strip().strip('"\'') for c in cats if c.strip()])
+    )
+
+def _critical_share_from_files(pattern):
+    """Share of Critical findings per category, read from previous result workbooks"""
+    frames = []
+    for file_path in glob.glob(pattern):
+        try:
+            frames.append(pd.read_excel(file_path, usecols=['categorization', 'severity_level']))
+        except Exception as e:
+            print(f"Skipping {file_path} for priority history: {e}")
+    if not frames:
+        return pd.Series(dtype=float)
+
+    history = pd.concat(frames, ignore_index=True)
+    history = history[history['severity_level'].notna()]
+    history = history.assign(category=split_categories(history['categorization'])).explode('category')
+    return (history['severity_level'] == 'Critical').groupby(history['category']).mean()
+
+def load_critical_categories(pattern="location_analysis_*.xlsx", min_share=0.1, rollup_store=None):
+    """
+    Find categories whose past results were often rated Critical.
+
+    Args:
+        pattern (str): Glob pattern for previous result workbooks
+        min_share (float): Minimum share of Critical findings for a category to be included
+        rollup_store (RollupStore): Rollups to read the history from; the workbooks matching
+            pattern are only read when no store is given or the store is empty
+
+    Returns:
+        list: Category names, or DEFAULT_CRITICAL_CATEGORIES if no history is available
+    """
+    critical_share = rollup_store.critical_share() if rollup_store is not None else pd.Series(dtype=float)
+    if critical_share.empty:
+        critical_share = _critical_share_from_files(pattern)
+    categories = critical_share[critical_share >= min_share].index.tolist()
+    return categories or DEFAULT_CRITICAL_CATEGORIES
+
+def prioritize_rows(df, critical_categories=None):
+    """
+    Order rows so the most important work runs first:
+    mandatory uploads, then Critical-prone categories, then the most recent answer_date.
+
+    Args:
+        df (pd.DataFrame): Rows to schedule
+        critical_categories (list): Categories historically prone to Critical findings
+
+    Returns:
+        pd.DataFrame: The same rows in priority order (index labels are kept)
+    """
+    critical_categories = critical_categories or DEFAULT_CRITICAL_CATEGORIES
+    if 'is_upload_mandatory' in df.columns:
+        mandatory = pd.to_numeric(df['is_upload_mandatory'], errors='coerce').fillna(0).astype(int)
+    else:
+        mandatory = pd.Series(0, index=df.index)
+    if 'categorization' in df.columns:
+        pattern = '|'.join(re.escape(category) for category in critical_categories)
+        critical = df['categorization'].fillna('').astype(str).str.contains(pattern, regex=True).astype(int)
+    else:
+        critical = pd.Series(0, index=df.index)
+    if 'answer_date' in df.columns:
+        answered = pd.to_datetime(df['answer_date'], errors='coerce')
+    else:
+        answered = pd.Series(pd.NaT, index=df.index)
+
+    keys = pd.DataFrame({'mandatory': mandatory, 'critical': critical, 'answered': answered}, index=df.index)
+    order = keys.sort_values(['mandatory', 'critical', 'answered'],
+                             ascending=[False, False, False],
+                             na_position='last', kind='stable').index
+    return df.loc[order]
+
+class RunBudget:
+    """
+    Wall-clock and cost limits for an analysis run. Once exhausted, no new model calls
+    are started and in-flight work is allowed to finish.
+
+    The cost limit is a hard cap: each call reserves cost_per_call before it starts and
+    is settled with the cost from the response's usage field, and a call is only started
+    when has_room() says the spend so far plus all open reservations leaves room for it.
+    For the cap to hold, cost_per_call must be the worst-case cost of a call, which callers
+    get by limiting max_tokens; it is also raised to the most expensive call seen.
+    The budget only counts as exhausted once the actual spend leaves no room;
+    while reservations are holding the room, callers wait for calls in flight to settle.
+
+    Args:
+        deadline (datetime.datetime): Stop starting new work at this local time
+        max_seconds (float): Stop starting new work after this many seconds
+        max_cost (float): Hard cap on spend in USD
+        cost_per_call (float): Upper bound on the cost of one model call in USD
+    """
+
+    def __init__(self, deadline=None, max_seconds=None, max_cost=None, cost_per_call=DEFAULT_COST_PER_CALL):
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.max_seconds = max_seconds
+        self.max_cost = max_cost
+        self.cost_per_call = cost_per_call
+        self.calls = 0
+        self.spent = 0.0
+        self.reserved = 0.0
+        self.metered_calls = 0
+        self.reason = None
+
+    def start(self):
+        """Restart the time budget, e.g. once prompts and planning are done and analysis begins"""
+        self.started = time.monotonic()
+
+    def reserve_call(self):
+        """Reserve the estimated cost of a model call that is about to start; returns the reservation"""
+        self.reserved += self.cost_per_call
+        return self.cost_per_call
+
+    def release_call(self, reservation):
+        """Drop a reservation for a call that was not completed"""
+        self.reserved = max(0.0, self.reserved - reservation)
+
+    def record_call(self, cost=None, reservation=0.0):
+        """
+        Record a model call, using the estimated cost unless an actual cost is given.
+
+        Args:
+            cost (float): Actual cost in USD, e.g. from usage_cost(response.usage)
+            reservation (float): Amount reserved for this call by reserve_call
+        """
+        self.release_call(reservation)
+        self.calls += 1
+        if cost is None:
+            self.spent += self.cost_per_call
+        else:
+            self.metered_calls += 1
+            self.spent += cost
+            self.cost_per_call = max(self.cost_per_call, cost)
+
+    def exhausted(self):
+        """Return True once any limit has been reached"""
+        if self.reason is None:
+            if self.deadline is not None and datetime.datetime.now() >= self.deadline:
+                self.reason = f"deadline {self.deadline:%Y-%m-%d %H:%M} reached"
+            elif self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds:
+                self.reason = f"time budget of {self.max_seconds}s used"
+            elif self.max_cost is not None and self.spent + self.cost_per_call > self.max_cost:
+                self.reason = f"cost budget of ${self.max_cost:.2f} used (${self.spent:.2f} spent)"
+        return self.reason is not None
+
+    def has_room(self):
+        """Return True if a call can start now without the spend plus open reservations passing max_cost"""
+        return self.max_cost is None or self.spent + self.reserved + self.cost_per_call <= self.max_cost
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        spent = f"${self.spent:.4f} spent" if self.metered_calls == self.calls else f"~${self.spent:.4f} spent"
+        return f"{self.calls} model calls, {spent}, {elapsed:.0f}s elapsed"
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import httpx
+import numpy as np
+from openai import AsyncOpenAI
+
+from analysis_pipeline import check_image_bytes
+from analysis_records import validate_model_result
+from analyze_checklist import (access_error_result, analysis_error_result, blankallowdquestion,
+                               build_openai_request, get_compact_prompt_template, get_image_url,
+                               get_prompt_template, invalid_url_result, no_image_result,
+                               parse_model_response, single_color_result)
+from row_rules import VALID_URL_PATTERN
+
+class ServiceOverloaded(Exception):
+    """Raised when a request is shed because too many analyses are already pending"""
+
+@lru_cache(maxsize=256)
+def cached_prompt_template(categorization, compact=False):
+    """Prompt template lookup, cached per distinct categorization string"""
+    if compact:
+        return get_compact_prompt_template(categorization)
+    return get_prompt_template(categorization)
+
+class LatencyTracker:
+    """Keeps the most recent request latencies and reports percentiles"""
+
+    def __init__(self, size=2000):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentiles(self):
+        if not self.samples:
+            return {'count': 0}
+        values = np.array(self.samples) * 1000
+        return {
+            'count': len(values),
+            'p50_ms': round(float(np.percentile(values, 50)), 1),
+            'p95_ms': round(float(np.percentile(values, 95)), 1),
+            'p99_ms': round(float(np.percentile(values, 99)), 1),
+            'max_ms': round(float(values.max()), 1),
+        }
+
+class AnalysisService:
+    """
+    Analyzes one checklist answer at a time with the same verdicts as analyze_image,
+    keeping clients, worker processes and caches warm between requests.
+
+    Args:
+        openai_client: AsyncOpenAI-compatible client
+        http_client (httpx.AsyncClient): Pooled client used to download images
+        decode_workers (int): Processes used for decoding and the single color check
+        max_concurrent (int): Analyses allowed to call the model at the same time
+        max_pending (int): Analyses admitted (running or waiting); further requests are shed
+        cache_size (int): Number of verdicts kept in the result cache
+        cache_ttl (float): Seconds a cached verdict stays valid
+        max_retries (int): Attempts for the image download and the model call
+        compact (bool): Use compact structured outputs for lower latency
+    """
+
+    def __init__(self, openai_client, http_client=None, decode_workers=2, max_concurrent=8,
+                 max_pending=64, cache_size=2048, cache_ttl=3600, max_retries=2, compact=False):
+        self.openai_client = openai_client
+        self.http_client = http_client or httpx.AsyncClient(
+            timeout=10, limits=httpx.Limits(max_connections=64, max_keepalive_connections=32))
+        self.decode_pool = ProcessPoolExecutor(max_workers=decode_workers)
+        self.model_slots = asyncio.Semaphore(max_concurrent)
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.max_retries = max_retries
+        self.compact = compact
+        self.cache = OrderedDict()
+        self.inflight = {}
+        self.latency = LatencyTracker()
+        self.counters = {'requests': 0, 'cache_hits': 0, 'coalesced': 0, 'shed': 0, 'model_calls': 0}
+
+    async def close(self):
+        await self.http_client.aclose()
+        self.decode_pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {**self.counters, 'pending': len(self.inflight), 'latency': self.latency.percentiles()}
+
+    async def analyze(self, question, categorization, upload_links):
+        """Return the verdict dict for one answer; raises ServiceOverloaded when shedding load"""
+        started = time.monotonic()
+        self.counters['requests'] += 1
+        result = await self._analyze(question, categorization, upload_links)
+        # Shed requests raise before this point, so they don't skew the percentiles
+        self.latency.add(time.monotonic() - started)
+        return result
+
+    async def _analyze(self, question, categorization, upload_links):
+        row = {'question': question, 'categorization': categorization, 'upload_links': upload_links}
+        if not upload_links:
+            return no_image_result(question)
+        image_url = get_image_url(row)
+        # Same check as the batch rule table, so both paths give the same verdict
+        if not image_url or not re.match(VALID_URL_PATTERN, image_url):
+            return invalid_url_result(question)
+        # Blank photos are accepted for these questions, so there is nothing to download or ask
+        if blankallowdquestion(question):
+            return single_color_result()
+
+        key = (question, categorization or '', image_url)
+        cached = self.cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            self.cache.move_to_end(key)
+            self.counters['cache_hits'] += 1
+            return cached[1]
+
+        # Identical requests already being analyzed share that analysis
+        if key in self.inflight:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(self.inflight[key])
+
+        if len(self.inflight) >= self.max_pending:
+            self.counters['shed'] += 1
+            raise ServiceOverloaded(f"{len(self.inflight)} analyses pending")
+
+        task = asyncio.ensure_future(self._run_analysis(question, categorization, image_url))
+        self.inflight[key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            self.inflight.pop(key, None)
+        if result.get('criteria_met') != 'Error' and 'access_error' not in result.get('image_quality_issues', []):
+            self.cache[key] = (time.monotonic(), result)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    async def _fetch(self, image_url):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                response = await self.http_client.get(image_url)
+                response.raise_for_status()
+                return response.content, None
+            except httpx.InvalidURL as e:
+                # A malformed URL fails the same way on every attempt
+                return None, access_error_result(attempt, e)
+            except httpx.HTTPError as e:
+                if attempt == self.max_retries:
+                    return None, access_error_result(self.max_retries, e)
+                await asyncio.sleep(0.5 * attempt)
+
+    async def _run_analysis(self, question, categorization, image_url):
+        content, failure = await self._fetch(image_url)
+        if failure is not None:
+            return failure
+
+        loop = asyncio.get_running_loop()
+        try:
+            is_multi_color = await loop.run_in_executor(self.decode_pool, check_image_bytes, content)
+        except Exception as e:
+            return analysis_error_result(1, e)
+        if not is_multi_color:
+            return single_color_result()
+
+        prompt = cached_prompt_template(categorization or '', self.compact).format(question=question)
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                async with self.model_slots:
+                    self.counters['model_calls'] += 1
+                    response = await self.openai_client.chat.completions.create(
+                        **build_openai_request(prompt, image_url, self.compact))
+                result = validate_model_result(parse_model_response(response, self.compact))
+                return {**result, 'image_quality_issues': list(result['image_quality_issues']),
+                        'tags': list(result['tags'])}
+            except Exception as e:
+                if attempt == self.max_retries:
+                    return analysis_error_result(self.max_retries, e)
+                await asyncio.sleep(0.5 * attempt)
+
+def create_app(service_factory=None):
+    """
+    Build the FastAPI app. The service is created on startup so its clients and
+    process pool live for the whole server lifetime.
+    """
+    from contextlib import asynccontextmanager
+
+    from fastapi import FastAPI, HTTPException
+    from pydantic import BaseModel
+
+    class AnswerRequest(BaseModel):
+        question: str
+        categorization: str = ''
+        upload_links: str = ''
+
+    @asynccontextmanager
+    async def lifespan(app):
+        factory = service_factory or (lambda: AnalysisService(AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")),
+                                                              compact=os.getenv("COMPACT_OUTPUT") == "1"))
+        app.state.service = factory()
+        yield
+        await app.state.service.close()
+
+    app = FastAPI(title="Checklist answer analysis", lifespan=lifespan)
+
+    @app.post("/analyze")
+    async def analyze(answer: AnswerRequest):
+        try:
+            return await app.state.service.analyze(answer.question, answer.categorization, answer.upload_links)
+        except ServiceOverloaded as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+
+    @app.get("/health")
+    async def health():
+        return {'status': 'ok'}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.service.stats()
+
+    return app
+
+class StubCompletions:
+    """Fake chat completions endpoint that answers every call with a fixed verdict"""
+
+    def __init__(self, delay=0.3, gate=None):
+        self.delay = delay
+        self.gate = gate
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        await asyncio.sleep(self.delay)
+        content = json.dumps({"criteria_met": "Yes", "explanation": "Stub verdict.", "severity": "None",
+                              "image_quality_issues": ["none"], "tags": ["stub"]})
+        message = type('Message', (), {'content': content, 'refusal': None})
+        choice = type('Choice', (), {'message': message, 'finish_reason': 'stop'})
+        return type('Response', (), {'choices': [choice], 'usage': None})
+
+class StubOpenAI:
+    """AsyncOpenAI stand-in for local runs and tests"""
+
+    def __init__(self, delay=0.3, gate=None):
+        self.chat = type('Chat', (), {'completions': StubCompletions(delay, gate)})
+
+def stub_http_client():
+    """httpx client that serves the same noisy test image for every URL, without a network"""
+    import io
+
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray((np.random.rand(256, 256, 3) * 255).astype('uint8')).save(buffer, 'PNG')
+    image_bytes = buffer.getvalue()
+    return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=image_bytes)))
+
+async def run_benchmark(requests_count=200, concurrency=32, duplicate_share=0.3, model_delay=0.3):
+    """
+    Exercise the HTTP API against local stubs (images served by an in-process transport,
+    a fake model with a fixed delay) and report latency percentiles.
+    """
+    import random
+
+    app = create_app(lambda: AnalysisService(StubOpenAI(model_delay), http_client=stub_http_client()))
+
+    async with app.router.lifespan_context(app):
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://service")
+        slots = asyncio.Semaphore(concurrency)
+        statuses = []
+
+        async def send(i):
+            # Some requests repeat a recent URL to exercise coalescing and the cache
+            image_id = random.randrange(max(1, i)) if i and random.random() < duplicate_share else i
+            async with slots:
+                response = await client.post("/analyze", json={
+                    'question': "Are the kitchen floors and drains clean?",
+                    'categorization': "[Hygiene & Cleanliness]",
+                    'upload_links': f"http://images.local/{image_id}.png",
+                })
+                statuses.append(response.status_code)
+
+        started = time.monotonic()
+        await asyncio.gather(*(send(i) for i in range(requests_count)))
+        elapsed = time.monotonic() - started
+        stats = (await client.get("/stats")).json()
+        await client.aclose()
+
+    print(f"{requests_count} requests in {elapsed:.1f}s ({requests_count / elapsed:.1f} req/s), "
+          f"{statuses.count(200)} OK, {statuses.count(503)} shed")
+    print(f"Latency: {stats['latency']}")
+    print(f"Cache hits: {stats['cache_hits']}, coalesced: {stats['coalesced']}, model calls: {stats['model_calls']}")
+    return stats
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        asyncio.run(run_benchmark())
+    else:
+        import uvicorn
+        uvicorn.run(create_app(), host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8000")))
@@ -1,4 +1,5 @@
 import pandas as pd
+import asyncio
 import json
 import requests
 from PIL import Image
@@ -6,12 +7,25 @@ import tempfile
 import io
 from io import BytesIO
 from black_image_detector import is_single_color_image
-from openai import OpenAI
+from openai import AsyncOpenAI
+from analysis_pipeline import AnalysisPipeline, PipelineConfig, PipelineJob
+from analysis_records import AnalysisRecord, apply_records, validate_model_result
+from analysis_scheduler import RunBudget, load_critical_categories, prioritize_rows, usage_cost
+from work_queue import DEAD, DONE, default_worker_id, open_queue
+from sampling_audit import SamplingConfig, generate_sampling_summary, run_sampling_audit
+from compliance_rollups import RollupStore
+from run_estimator import ImageMetadataCache, estimate_run, max_call_cost
+from row_rules import (RowRule, blank_photo_allowed, classify_rows, invalid_url, is_skipped, missing_mandatory_upload,
+                       non_image_link, print_rule_report, rule_records, unreachable_host)
 import os
 import datetime
 import time
 from collections import Counter
 import re
+import sys
+import argparse
+import multiprocessing
+from dataclasses import asdict
 
 # Add at the top of the file after imports
 skip_count = 0  # Global counter for skipped OpenAI analyses
@@ -283,46 +297,211 @@ def get_prompt_template(categories):
     # If no matching category is found, return the default template
     return default_template
 
+def blankallowdquestion(question): #this function is to check if the question allows a blank photo question
+    if "Please click a blank photo if not applicable" in question:
+        return True
+    else:
+        return False
+
+# Compact output mode: short fields constrained by a strict JSON schema
+COMPACT_QUALITY_ISSUES = ["none", "too_dark", "too_blurry", "obstructed", "out_of_frame"]
+COMPACT_MAX_TOKENS = 200
+
+# Output limit of standard responses while a cost budget is active, so every call has a known worst-case cost
+BUDGETED_MAX_TOKENS = 1000
+
+COMPACT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "compliance_verdict",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "verdict": {"type": "string", "enum": ["Yes", "No", "Unable to determine"]},
+                "why": {"type": "string"},
+                "fix": {"type": "string"},
+                "severity": {"type": "string", "enum": ["Critical", "Major", "Minor", "None"]},
+                "quality": {"type": "array", "items": {"type": "string", "enum": COMPACT_QUALITY_ISSUES}},
+                "tags": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["verdict", "why", "fix", "severity", "quality", "tags"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+COMPACT_OUTPUT_INSTRUCTIONS = """
+        Respond in JSON with these fields and keep every text field short:
+        1. "verdict": "Yes" if compliant, "No" if not compliant, "Unable to determine" if the image alone cannot answer the question
+        2. "why": Reason for the verdict in at most 25 words
+        3. "fix": One actionable recommendation in at most 15 words, or "" if compliant
+        4. "severity": "Critical", "Major", "Minor", or "None"
+        5. "quality": Image quality issues, or ["none"]
+        6. "tags": Up to 3 short tags
+    """
+
+# Category template with the free-form output section replaced by the compact one
+def get_compact_prompt_template(categories):
+    template = get_prompt_template(categories)
+    return template.split("Analyze the image and provide")[0] + COMPACT_OUTPUT_INSTRUCTIONS
+
+# Map a compact response back to the standard result keys
+def expand_compact_result(result):
+    quality = result.get("quality") or ["none"]
+    return {
+        "criteria_met": result.get("verdict"),
+        "explanation": result.get("why", ""),
+        "improvements": result.get("fix", ""),
+        "severity": result.get("severity"),
+        "image_quality_issues": quality,
+        "quality_assessment": "No quality issues" if quality == ["none"] else f"Quality issues: {', '.join(quality)}",
+        "tags": result.get("tags") or ["untagged"],
+    }
+
+# Build the chat completion arguments for a prompt and image URL
+def build_openai_request(prompt, image_url, compact=False, max_tokens=None):
+    request = {
+        "model": "gpt-4o",
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url,
+                    },
+                },
+            ],
+        }],
+        "response_format": {"type": "json_object"}
+    }
+    if max_tokens is not None:
+        request["max_tokens"] = max_tokens
+    if compact:
+        request["response_format"] = COMPACT_RESPONSE_FORMAT
+        request["max_tokens"] = COMPACT_MAX_TOKENS
+    return request
+
+# Parse a chat completion into a result dict with the standard keys
+def parse_model_response(response, compact=False):
+    choice = response.choices[0]
+    if getattr(choice, "finish_reason", None) == "length":
+        raise ValueError("Response was cut off at its max_tokens limit")
+    if compact:
+        if getattr(choice.message, "refusal", None):
+            raise ValueError(f"Model refused the request: {choice.message.refusal}")
+        return expand_compact_result(json.loads(choice.message.content))
+    return json.loads(choice.message.content)
+
+# Results returned when the image can't be sent to OpenAI
+def no_image_result(question):
+    return {
+        "criteria_met": "Unable to determine",
+        "explanation": f"No image provided for the question: {question}",
+        "improvements": "Ensure images are uploaded to verify compliance.",
+        "severity": "Unknown",
+        "image_quality_issues": ["no_image"],
+        "quality_assessment": "No image available for assessment",
+        "tags": ["missing_data", "no_visual_evidence", "incomplete_submission"]
+    }
+
+def invalid_url_result(question):
+    return {
+        "criteria_met": "Unable to determine",
+        "explanation": f"Could not extract a valid image URL for question: {question}",
+        "improvements": "Check that image URLs are properly formatted and accessible.",
+        "severity": "Unknown",
+        "image_quality_issues": ["invalid_url"],
+        "quality_assessment": "No valid image URL found",
+        "tags": ["technical_issue", "url_error", "data_issue"]
+    }
+
+def single_color_result():
+    return {
+        "criteria_met": "Unable to determine",
+        "explanation": "Image is a single color and cannot be analyzed.",
+        "improvements": "Check the image for compliance.",
+        "severity": "Unknown",
+        "image_quality_issues": ["too_dark"],
+        "quality_assessment": "Could not access image for assessment",
+        "tags": ["too_dark"]
+    }
+
+def access_error_result(max_retries, error):
+    return {
+        "criteria_met": "Unable to determine",
+        "explanation": f"Could not access the image after {max_retries} attempts: {str(error)}",
+        "improvements": "Ensure the image URL is accessible and try again.",
+        "severity": "Unknown",
+        "image_quality_issues": ["access_error"],
+        "quality_assessment": "Could not access image for assessment",
+        "tags": ["technical_error", "connectivity_issue", "access_denied"]
+    }
+
+def skipped_result(question):
+    return {
+        "criteria_met": "Unable to determine",
+        "explanation": f"The question was skipped in the checklist: {question}",
+        "improvements": "Answer the question instead of skipping it.",
+        "severity": "Unknown",
+        "image_quality_issues": ["no_image"],
+        "quality_assessment": "Question skipped, no image to assess",
+        "tags": ["skipped", "incomplete_submission"]
+    }
+
+def non_image_result(question):
+    return {
+        "criteria_met": "Unable to determine",
+        "explanation": f"The upload for this question is not an image: {question}",
+        "improvements": "Upload a photo instead of a document or video.",
+        "severity": "Unknown",
+        "image_quality_issues": ["not_an_image"],
+        "quality_assessment": "Upload is not an image",
+        "tags": ["data_issue", "not_an_image"]
+    }
+
+def unreachable_host_result(question):
+    return {
+        "criteria_met": "Unable to determine",
+        "explanation": f"The image is stored on a host that can't be reached from outside: {question}",
+        "improvements": "Upload images to the public checklist storage.",
+        "severity": "Unknown",
+        "image_quality_issues": ["access_error"],
+        "quality_assessment": "Could not access image for assessment",
+        "tags": ["technical_issue", "url_error", "unreachable_host"]
+    }
+
+def analysis_error_result(max_retries, error):
+    return {
+        "criteria_met": "Error",
+        "explanation": f"Analysis failed after {max_retries} attempts: {str(error)}",
+        "improvements": "Try again with a different image or check system configuration.",
+        "severity": "Unknown",
+        "image_quality_issues": ["analysis_error"],
+        "quality_assessment": "Error during image analysis process",
+        "tags": ["error", "analysis_failed", "technical_issue"]
+    }
+
 # Function to analyze an image using OpenAI
-def analyze_image(client, row, max_retries=3):
+def analyze_image(client, row, max_retries=3, compact=False):
     # Get the question
     question = row['question']
     
     # Skip if no image is provided
     if pd.isna(row['upload_links']) or not row['upload_links']:
-        return {
-            "criteria_met": "Unable to determine",
-            "explanation": f"No image provided for the question: {question}",
-            "improvements": "Ensure images are uploaded to verify compliance.",
-            "severity": "Unknown",
-            "image_quality_issues": ["no_image"],
-            "quality_assessment": "No image available for assessment",
-            "tags": ["missing_data", "no_visual_evidence", "incomplete_submission"]
-        }
+        return no_image_result(question)
     
     # Get image URL
     image_url = get_image_url(row)
     if not image_url:
-        return {
-            "criteria_met": "Unable to determine",
-            "explanation": f"Could not extract a valid image URL for question: {question}",
-            "improvements": "Check that image URLs are properly formatted and accessible.",
-            "severity": "Unknown",
-            "image_quality_issues": ["invalid_url"],
-            "quality_assessment": "No valid image URL found",
-            "tags": ["technical_issue", "url_error", "data_issue"]
-        }
+        return invalid_url_result(question)
     
     # Get the appropriate prompt template based on categories
     categories = row.get('categorization', [])
-    prompt_template = get_prompt_template(categories)
+    prompt_template = get_compact_prompt_template(categories) if compact else get_prompt_template(categories)
     prompt = prompt_template.format(question=question)
-
-    def blankallowdquestion(question): #this function is to check if the question allows a blank photo question
-        if "Please click a blank photo if not applicable" in question:
-            return True
-        else:
-            return False
     
     # Implement retry logic with proper error handling
     retries = 0
@@ -351,38 +530,15 @@ def analyze_image(client, row, max_retries=3):
                 skip_count += 1
                 print("Image is a single color. Skipping OpenAI analysis.")
                 
-                return {
-                        "criteria_met": "Unable to determine",
-                        "explanation": "Image is a single color and cannot be analyzed.",
-                        "improvements": "Check the image for compliance.",
-                        "severity": "Unknown",
-                        "image_quality_issues": ["too_dark"],
-                        "quality_assessment": "Could not access image for assessment",
-                        "tags": ["too_dark"]
-                }
+                return single_color_result()
             else:
                 print("Image is not a single color. Proceeding with OpenAI analysis.")
                 # Now proceed with OpenAI analysis
                 print("Sending image to OpenAI for analysis...")
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[{
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url,
-                                },
-                            },
-                        ],
-                    }],
-                    response_format={"type": "json_object"}
-                )
+                response = client.chat.completions.create(**build_openai_request(prompt, image_url, compact))
                 
-            # Parse the result
-            result = json.loads(response.choices[0].message.content)
+            # Parse and validate the result; malformed output is retried
+            result = validate_model_result(parse_model_response(response, compact))
             print("Analysis completed successfully.")
 
             # Clean up temporary file
@@ -403,15 +559,7 @@ def analyze_image(client, row, max_retries=3):
                 time.sleep(2**retries)  # Exponential backoff
             else:
                 print(f"Failed to access image after {max_retries} attempts.")
-                return {
-                    "criteria_met": "Unable to determine",
-                    "explanation": f"Could not access the image after {max_retries} attempts: {str(e)}",
-                    "improvements": "Ensure the image URL is accessible and try again.",
-                    "severity": "Unknown",
-                    "image_quality_issues": ["access_error"],
-                    "quality_assessment": "Could not access image for assessment",
-                    "tags": ["technical_error", "connectivity_issue", "access_denied"]
-                }
+                return access_error_result(max_retries, e)
         
         except Exception as e:
             print(f"Error during analysis: {e}")
@@ -421,25 +569,113 @@ def analyze_image(client, row, max_retries=3):
                 time.sleep(2**retries)  # Exponential backoff
             else:
                 print(f"Analysis failed after {max_retries} attempts.")
-                return {
-                    "criteria_met": "Error",
-                    "explanation": f"Analysis failed after {max_retries} attempts: {str(e)}",
-                    "improvements": "Try again with a different image or check system configuration.",
-                    "severity": "Unknown",
-                    "image_quality_issues": ["analysis_error"],
-                    "quality_assessment": "Error during image analysis process",
-                    "tags": ["error", "analysis_failed", "technical_issue"]
-                }
+                return analysis_error_result(max_retries, e)
+
+# Rows that can be decided from the data alone, tried in order; the first matching rule wins
+PREFILTER_RULES = [
+    RowRule("skipped question", is_skipped, skipped_result),
+    RowRule("mandatory upload missing", missing_mandatory_upload, no_image_result),
+    RowRule("invalid URL", invalid_url, invalid_url_result),
+    RowRule("non-image upload", non_image_link, non_image_result),
+    RowRule("unreachable host", unreachable_host, unreachable_host_result),
+    # Blank photos are accepted for these questions, so the image is never sent to the model
+    RowRule("blank photo allowed", blank_photo_allowed, lambda question: single_color_result()),
+]
+
+# Resolve rule-table rows in bulk; returns the rule name per row and the records of resolved rows
+def prefilter_rows(df, rules=PREFILTER_RULES):
+    resolved_by = classify_rows(df, rules)
+    print_rule_report(resolved_by, rules)
+    return resolved_by, rule_records(df, resolved_by, rules)
+
+# Function to select the rows for the chosen cafes and vendors
+def filter_selected_locations(df, selected_cafes, selected_vendors):
+    cafe_filter = (df['checklist_type'] == 'cafe') & (df['location_name'].isin(selected_cafes))
+    vendor_filter = (df['checklist_type'] == 'vendor') & (df['location_name'].isin(selected_vendors))
+    return df[cafe_filter | vendor_filter].copy()
+
+# Function to select the rows that have an image upload
+def select_image_rows(df):
+    return df[~df['upload_links'].isna() & (df['upload_links'] != '')]
+
+# Build pipeline jobs; rows without a usable URL are resolved before any network work
+def build_pipeline_jobs(image_df, compact=False):
+    jobs = []
+    for idx, row in image_df.iterrows():
+        job = PipelineJob(key=idx, question=row['question'])
+        image_url = get_image_url(row)
+        if not image_url:
+            job.result = AnalysisRecord.from_result(invalid_url_result(row['question']))
+        else:
+            job.image_url = image_url
+            categories = row.get('categorization', [])
+            template = get_compact_prompt_template(categories) if compact else get_prompt_template(categories)
+            job.prompt = template.format(question=row['question'])
+        jobs.append(job)
+    return jobs
+
+# Build the LLM stage coroutine for the analysis pipeline
+def make_openai_analyzer(client_factory, budget=None, compact=False):
+    # A client's pooled connections belong to the event loop that opened them, and every
+    # AnalysisPipeline.run starts a new loop, so each loop gets its own client
+    clients = {}
+    def loop_client():
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            # Clients of earlier loops can't be reused once those loops are closed
+            clients.clear()
+            clients[loop] = client_factory()
+        return clients[loop]
+    
+    # A cost budget needs an output limit to bound what each call can cost
+    max_tokens = BUDGETED_MAX_TOKENS if budget is not None and budget.max_cost is not None else None
+    
+    async def analyze(job):
+        client = loop_client()
+        if not job.is_multi_color or blankallowdquestion(job.question):
+            global skip_count
+            skip_count += 1
+            return AnalysisRecord.from_result(single_color_result())
+        request = build_openai_request(job.prompt, job.image_url, compact, max_tokens)
+        if budget is None:
+            response = await client.chat.completions.create(**request)
+        else:
+            # Reserved before the call and settled from the billed usage, so the cost cap holds with calls in flight
+            reservation = budget.reserve_call()
+            try:
+                response = await client.chat.completions.create(**request)
+            except Exception:
+                budget.release_call(reservation)
+                raise
+            budget.record_call(usage_cost(getattr(response, 'usage', None)), reservation)
+        # Raises ValueError on output that doesn't match the result schema, which is retried
+        return AnalysisRecord.from_result(parse_model_response(response, compact))
+    return analyze
+
+# Estimate the cost and duration of analyzing the selected locations without calling the model
+def plan_selected_locations(df, selected_cafes, selected_vendors, pipeline_config=None, compact=False,
+                            metadata_cache=None):
+    filtered_df = filter_selected_locations(df, selected_cafes, selected_vendors)
+    image_df = select_image_rows(filtered_df[classify_rows(filtered_df, PREFILTER_RULES).isna()])
+    return estimate_run(build_pipeline_jobs(image_df, compact), pipeline_config or PipelineConfig(), compact,
+                        cache=metadata_cache)
+
+# Result recorded for a row that failed in a pipeline stage
+def pipeline_failure_result(stage, max_retries, error):
+    if stage == 'fetch':
+        return AnalysisRecord.from_result(access_error_result(max_retries, error))
+    return AnalysisRecord.from_result(analysis_error_result(max_retries, error))
 
 # Function to analyze selected locations
-def analyze_selected_locations(df, selected_cafes, selected_vendors, api_key):
-    # Configure OpenAI client
-    client = OpenAI(api_key=api_key)
+def analyze_selected_locations(df, selected_cafes, selected_vendors, api_key, pipeline_config=None,
+                               budget=None, critical_categories=None, sampling=None, rollup_store=None,
+                               compact=False):
+    # The time budget covers the analysis itself, not the prompts and planning before it
+    if budget is not None:
+        budget.start()
     
     # Filter data for selected cafes and vendors
-    cafe_filter = (df['checklist_type'] == 'cafe') & (df['location_name'].isin(selected_cafes))
-    vendor_filter = (df['checklist_type'] == 'vendor') & (df['location_name'].isin(selected_vendors))
-    filtered_df = df[cafe_filter | vendor_filter].copy()
+    filtered_df = filter_selected_locations(df, selected_cafes, selected_vendors)
     
     # Show count of entries for each selected location
     print("\nEntries to be analyzed:")
@@ -452,74 +688,213 @@ def analyze_selected_locations(df, selected_cafes, selected_vendors, api_key):
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
     output_file = f"location_analysis_{timestamp}.xlsx"
     
-    # Add new columns to the dataframe for analysis results
-    # We're keeping all existing columns and just adding our analysis columns
-    filtered_df['compliance_status'] = None
-    filtered_df['explanation'] = None
-    filtered_df['improvement_suggestions'] = None
-    filtered_df['severity_level'] = None
-    filtered_df['image_quality_issues'] = None
-    filtered_df['quality_assessment'] = None
-    filtered_df['analysis_tags'] = None
-    filtered_df['analysis_date'] = None
+    # Validated results keyed by row index, assembled into columns when saving.
+    # Rows the rule table can decide from the data alone are resolved up front.
+    resolved_by, records = prefilter_rows(filtered_df)
+    filtered_df = apply_records(filtered_df, records)
+    # Blank-allowed rows used to be skipped in the model stage; keep counting them as skipped analyses
+    global skip_count
+    skip_count += int(resolved_by.eq("blank photo allowed").sum())
     
     # Analyze each row that has image data
     total_rows = len(filtered_df)
     analyzed_count = 0
     
-    # Filter to focus only on entries with image uploads (as requested)
-    image_df = filtered_df[~filtered_df['upload_links'].isna() & (filtered_df['upload_links'] != '')]
+    # Filter to focus only on entries with image uploads that still need the model
+    image_df = select_image_rows(filtered_df[resolved_by.isna()])
     print(f"\nFound {len(image_df)} entries with images to analyze out of {total_rows} total entries")
     
     if len(image_df) == 0:
         print("No entries with images found for analysis. Exiting.")
+        if records:
+            filtered_df.to_excel(output_file, index=False)
+            if rollup_store is not None:
+                rollup_store.add_results(filtered_df.loc[list(records)])
+            print(f"Rule results saved to {output_file}")
         return filtered_df
     
-    for idx, row in image_df.iterrows():
+    # Work on mandatory, Critical-prone and recent rows first so a budget cut-off drops the least important rows
+    if critical_categories is None:
+        critical_categories = load_critical_categories(rollup_store=rollup_store)
+    image_df = prioritize_rows(image_df, critical_categories)
+    
+    analyze = make_openai_analyzer(lambda: AsyncOpenAI(api_key=api_key), budget, compact)
+    
+    # Rows analyzed since the rollup store was last updated
+    rollup_pending = list(records)
+    def flush_rollups():
+        if rollup_store is not None and rollup_pending:
+            rollup_store.add_results(filtered_df.loc[rollup_pending])
+            rollup_pending.clear()
+    
+    def write_result(job):
+        nonlocal analyzed_count, filtered_df
         analyzed_count += 1
-        print(f"\nAnalyzing record {analyzed_count}/{len(image_df)} for {row['location_name']} ({row['checklist_type']})")
+        record = job.result
+        records[job.key] = record
+        rollup_pending.append(job.key)
+        row = image_df.loc[job.key]
+        print(f"\nAnalyzed record {analyzed_count}/{len(image_df)} for {row['location_name']} ({row['checklist_type']})")
         print(f"Question: {row['question']}")
-        
-        result = analyze_image(client, row)
-        
-        # Format image quality issues as string if it's a list
-        image_quality_issues = result.get('image_quality_issues', ['none'])
-        if isinstance(image_quality_issues, list):
-            image_quality_issues = ', '.join(image_quality_issues)
-        
-        # Format tags as string if it's a list
-        tags = result.get('tags', ['untagged'])
-        if isinstance(tags, list):
-            tags = ', '.join(tags)
-        
-        # Update the dataframe with analysis results
-        filtered_df.at[idx, 'compliance_status'] = result.get('criteria_met', 'Unknown')
-        filtered_df.at[idx, 'explanation'] = result.get('explanation', '')
-        filtered_df.at[idx, 'improvement_suggestions'] = result.get('improvements', '')
-        filtered_df.at[idx, 'severity_level'] = result.get('severity', 'Unknown')
-        filtered_df.at[idx, 'image_quality_issues'] = image_quality_issues
-        filtered_df.at[idx, 'quality_assessment'] = result.get('quality_assessment', '')
-        filtered_df.at[idx, 'analysis_tags'] = tags
-        filtered_df.at[idx, 'analysis_date'] = datetime.datetime.now().strftime("%Y-%m-%d")
-        
-        print(f"Compliance: {filtered_df.at[idx, 'compliance_status']}")
-        print(f"Severity: {filtered_df.at[idx, 'severity_level']}")
+        print(f"Compliance: {record.criteria_met}")
+        print(f"Severity: {record.severity}")
         
         # Save progress after each analysis or in batches
-        if analyzed_count % 5 == 0 or analyzed_count == len(image_df):
+        if analyzed_count % 5 == 0:
             # Save all columns including original ones to the Excel file
+            filtered_df = apply_records(filtered_df, records)
             filtered_df.to_excel(output_file, index=False)
+            flush_rollups()
             print(f"Progress saved to {output_file} ({analyzed_count}/{len(image_df)} completed)")
             
             # Show interim stats
             print("\nInterim Analysis Summary:")
             compliance_counts = filtered_df['compliance_status'].value_counts()
             print("Compliance Status:")
-            print(compliance_counts)
+            print(compliance_counts[compliance_counts > 0])
+    
+    # Fetch, quality-check and analyze images concurrently with bounded queues between stages
+    should_stop = budget.exhausted if budget is not None else None
+    can_start = budget.has_room if budget is not None else None
+    def analyze_rows(rows_df):
+        jobs = build_pipeline_jobs(rows_df, compact)
+        if budget is not None and budget.max_cost is not None:
+            # Reserve the worst case of any call so calls in flight can't push the spend past the cap
+            output_limit = COMPACT_MAX_TOKENS if compact else BUDGETED_MAX_TOKENS
+            budget.cost_per_call = max([budget.cost_per_call] +
+                                       [max_call_cost(job.prompt, output_limit) for job in jobs if job.prompt])
+        pipeline = AnalysisPipeline(analyze, write_result, pipeline_failure_result, config=pipeline_config,
+                                    should_stop=should_stop, can_start=can_start)
+        pipeline.run(jobs)
+        return {idx: records[idx] for idx in rows_df.index if idx in records}
+    
+    if sampling is not None:
+        # Reporting runs only analyze enough rows per location and category for the configured interval width
+        run_sampling_audit(image_df, analyze_rows, sampling)
+    else:
+        analyze_rows(image_df)
+    
+    # Final save; rows skipped at the budget cut-off or by sampling are left without results
+    filtered_df = apply_records(filtered_df, records)
+    filtered_df.to_excel(output_file, index=False)
+    flush_rollups()
     
+    if budget is not None:
+        print(f"\nBudget: {budget.summary()}")
+        if budget.exhausted():
+            not_analyzed = len(image_df) - int(image_df.index.isin(list(records)).sum())
+            print(f"Stopped early: {budget.reason}. {not_analyzed} of {len(image_df)} entries were not analyzed.")
     print(f"\nAnalysis complete! Results saved to {output_file}")
     return filtered_df
 
+# Function to load the checklist export (CSV or Excel)
+def load_source(file_path):
+    if file_path.lower().endswith('.csv'):
+        return pd.read_csv(file_path)
+    return load_data(file_path)
+
+# Coordinator: put the image rows of the selected locations on a work queue
+def enqueue_selected_locations(df, source_path, selected_cafes, selected_vendors, queue, critical_categories=None,
+                               rollup_store=None):
+    filtered_df = filter_selected_locations(df, selected_cafes, selected_vendors)
+    # Rule-resolved rows aren't queued; the merger resolves them again from the source data
+    image_df = select_image_rows(filtered_df[classify_rows(filtered_df, PREFILTER_RULES).isna()])
+    if critical_categories is None:
+        critical_categories = load_critical_categories(rollup_store=rollup_store)
+    image_df = prioritize_rows(image_df, critical_categories)
+    
+    # Rows are sent as JSON and keyed by their index in the source file so the merger can find them
+    payloads = json.loads(image_df.to_json(orient='records', date_format='iso'))
+    run_id = queue.create_run(source_path, selected_cafes, selected_vendors)
+    count = queue.enqueue(run_id, zip(image_df.index.tolist(), payloads))
+    print(f"Queued {count} image entries for run {run_id} ({len(filtered_df)} entries selected)")
+    return run_id
+
+# Worker: lease rows from the queue, analyze them and acknowledge the results
+def run_queue_worker(queue, api_key, worker_id=None, batch_size=8, visibility_timeout=600,
+                     pipeline_config=None, poll_interval=5, idle_timeout=None, compact=False):
+    worker_id = worker_id or default_worker_id()
+    # Leases held by a crashed worker are only re-delivered once they expire, so a worker
+    # never gives up waiting sooner than one visibility timeout
+    if idle_timeout is not None:
+        idle_timeout = max(idle_timeout, visibility_timeout + poll_interval)
+    analyze = make_openai_analyzer(lambda: AsyncOpenAI(api_key=api_key), compact=compact)
+    leases = {}
+    processed = 0
+    
+    def write_result(pipeline_job):
+        nonlocal processed
+        lease = leases.pop(pipeline_job.key)
+        record = pipeline_job.result
+        # Errors are released for another attempt and dead-lettered after max_attempts
+        if record.criteria_met == 'Error' or 'access_error' in record.image_quality_issues:
+            queue.fail(lease, record.explanation, asdict(record))
+        elif not queue.ack(lease, asdict(record)):
+            print(f"[{worker_id}] Lease on job {lease.job_id} expired before it was acknowledged")
+        processed += 1
+        if processed % batch_size == 0:
+            print(f"[{worker_id}] Processed {processed} jobs. Queue: {queue.counts()}")
+    
+    # Leases are taken as the pipeline has room for them; a full fetch queue pauses leasing
+    async def leased_jobs():
+        loop = asyncio.get_running_loop()
+        idle_since = time.monotonic()
+        while True:
+            leased = await loop.run_in_executor(
+                None, lambda: queue.lease(worker_id, batch_size=batch_size, visibility_timeout=visibility_timeout))
+            if not leased:
+                counts = await loop.run_in_executor(None, queue.counts)
+                if counts['pending'] == 0 and counts['leased'] == 0:
+                    return
+                # Outstanding leases are either acknowledged or expire and are leased again here
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    print(f"[{worker_id}] No work available for {idle_timeout}s. Stopping.")
+                    return
+                await asyncio.sleep(poll_interval)
+                continue
+            idle_since = time.monotonic()
+            
+            for job in leased:
+                leases[job.job_id] = job
+            batch_df = pd.DataFrame([job.payload for job in leased], index=[job.job_id for job in leased])
+            for pipeline_job in build_pipeline_jobs(batch_df, compact):
+                yield pipeline_job
+    
+    # One pipeline, with its thread and process pools, serves the worker's whole lifetime
+    pipeline = AnalysisPipeline(analyze, write_result, pipeline_failure_result, config=pipeline_config)
+    pipeline.run(leased_jobs())
+    print(f"[{worker_id}] Processed {processed} jobs. Queue: {queue.counts()}")
+    return processed
+
+def _worker_process(queue_spec, api_key, worker_id, batch_size, visibility_timeout, max_attempts, compact,
+                    idle_timeout=None):
+    queue = open_queue(queue_spec, max_attempts=max_attempts)
+    run_queue_worker(queue, api_key, worker_id=worker_id, batch_size=batch_size,
+                     visibility_timeout=visibility_timeout, idle_timeout=idle_timeout, compact=compact)
+
+# Merger: rebuild the results workbook for a queued run
+def merge_queue_results(queue, run_id, df=None, rollup_store=None):
+    run = queue.get_run(run_id)
+    if df is None:
+        df = load_source(run['source_path'])
+    filtered_df = filter_selected_locations(df, run['selected_cafes'], run['selected_vendors'])
+    
+    _, records = prefilter_rows(filtered_df)
+    for row_key, status, result, error in queue.results(run_id):
+        # Dead-lettered rows keep the result of their last failed attempt
+        if status in (DONE, DEAD) and result is not None:
+            records[row_key] = AnalysisRecord.from_result(result, analysis_date=result.get('analysis_date'))
+    filtered_df = apply_records(filtered_df, records)
+    
+    output_file = f"location_analysis_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    filtered_df.to_excel(output_file, index=False)
+    if rollup_store is not None:
+        rollup_store.add_results(filtered_df)
+    counts = queue.counts(run_id)
+    print(f"Merged {len(records)} results for run {run_id} into {output_file}")
+    print(f"Done: {counts['done']}, dead-lettered: {counts['dead']}, still pending: {counts['pending'] + counts['leased']}")
+    return filtered_df
+
 # Function to generate analysis summary
 def generate_summary(analyzed_df):
     # Filter to focus only on rows that were analyzed
@@ -533,8 +908,11 @@ def generate_summary(analyzed_df):
     print(f"Total entries analyzed: {len(analyzed_only)}")
     
     # Overall compliance and severity
+    # Categorical columns report every category, so drop the ones that never occur
     compliance_counts = analyzed_only['compliance_status'].value_counts()
+    compliance_counts = compliance_counts[compliance_counts > 0]
     severity_counts = analyzed_only['severity_level'].value_counts()
+    severity_counts = severity_counts[severity_counts > 0]
     
     print("\nOverall Compliance Status:")
     print(compliance_counts)
@@ -556,7 +934,7 @@ def generate_summary(analyzed_df):
             
             print(f"\n{location_type.capitalize()} ({len(type_df)} entries):")
             print("  Compliance:")
-            for status, count in type_compliance.items():
+            for status, count in type_compliance[type_compliance > 0].items():
                 print(f"    {status}: {count}")
     
     # Analysis by location
@@ -567,7 +945,7 @@ def generate_summary(analyzed_df):
         
         print(f"\n{location} ({len(loc_df)} entries):")
         print("  Compliance:")
-        for status, count in loc_compliance.items():
+        for status, count in loc_compliance[loc_compliance > 0].items():
             print(f"    {status}: {count}")
     
     # Top tags
@@ -642,11 +1020,51 @@ def main():
         print("API key is required. Exiting.")
         return
     
+    # Optional run budget; the highest-priority rows are analyzed first
+    budget = None
+    time_limit = input("Enter a time budget in minutes (leave blank for none): ").strip()
+    cost_limit = input("Enter a cost budget in USD (leave blank for none): ").strip()
+    try:
+        if time_limit or cost_limit:
+            budget = RunBudget(max_seconds=float(time_limit) * 60 if time_limit else None,
+                               max_cost=float(cost_limit) if cost_limit else None)
+    except ValueError:
+        print("Invalid budget entered. Running without a budget.")
+    
+    # Sampling audits estimate per-location compliance from a fraction of the images
+    sampling = None
+    if input("Run a sampling audit instead of analyzing every image? (y/n): ").lower() == 'y':
+        sampling = SamplingConfig()
+        width = input(f"Target confidence interval width in percent (default {sampling.target_width:.0%}): ").strip()
+        try:
+            if width:
+                sampling.target_width = float(width.rstrip('%')) / 100
+        except ValueError:
+            print(f"Invalid width entered. Using {sampling.target_width:.0%}.")
+    
+    # Compact mode asks for short, schema-constrained answers to cut output tokens
+    compact = input("Use compact output mode (shorter explanations, faster and cheaper)? (y/n): ").lower() == 'y'
+    
+    # Dry-run plan: projected cost and time before any model call is made
+    estimate = plan_selected_locations(df, selected_cafes, selected_vendors, compact=compact,
+                                       metadata_cache=ImageMetadataCache())
+    estimate.report()
+    if sampling is not None:
+        print("A sampling audit analyzes only part of these entries, so it will cost less.")
+    if input("Proceed with the analysis? (y/n): ").lower() != 'y':
+        print("Analysis cancelled.")
+        return
+    
     # Run analysis
-    analyzed_df = analyze_selected_locations(df, selected_cafes, selected_vendors, api_key)
+    analyzed_df = analyze_selected_locations(df, selected_cafes, selected_vendors, api_key, budget=budget,
+                                             sampling=sampling, rollup_store=RollupStore(), compact=compact)
     
     # Generate summary
     generate_summary(analyzed_df)
+    if sampling is not None:
+        # Only rows left to the model were sampled; rule-resolved rows would inflate the sampled counts
+        generate_sampling_summary(analyzed_df, sampling.confidence,
+                                  resolved_by=classify_rows(analyzed_df, PREFILTER_RULES))
     
     # Ask if user wants to export detailed non-compliant items
     export_option = input("\nDo you want to export a detailed list of non-compliant items? (y/n): ")
@@ -662,5 +1080,58 @@ def main():
     # Print the final skip count
     print(f"\nTotal number of times OpenAI analysis was skipped: {skip_count}")
 
+def queue_main(argv):
+    parser = argparse.ArgumentParser(description="Distributed checklist image analysis")
+    parser.add_argument('--queue', default='analysis_queue.db', help="SQLite file path or redis:// URL")
+    parser.add_argument('--max-attempts', type=int, default=3)
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    enqueue = commands.add_parser('enqueue', help="Queue image rows for the selected locations")
+    enqueue.add_argument('source', help="Checklist export (CSV or Excel)")
+    enqueue.add_argument('--cafe', action='append', default=[], help="Cafe name (repeatable)")
+    enqueue.add_argument('--vendor', action='append', default=[], help="Vendor name (repeatable)")
+    
+    worker = commands.add_parser('worker', help="Lease and analyze queued rows")
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--batch-size', type=int, default=8)
+    worker.add_argument('--visibility-timeout', type=int, default=600)
+    worker.add_argument('--idle-timeout', type=int, default=None,
+                        help="Stop after this many seconds without work (default: wait while leases are outstanding; "
+                             "never less than the visibility timeout)")
+    worker.add_argument('--compact', action='store_true', help="Use compact structured outputs")
+    
+    merge = commands.add_parser('merge', help="Rebuild the results workbook for a run")
+    merge.add_argument('run_id')
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'enqueue':
+        queue = open_queue(args.queue, max_attempts=args.max_attempts)
+        enqueue_selected_locations(load_source(args.source), args.source, args.cafe, args.vendor, queue,
+                                   rollup_store=RollupStore())
+    elif args.command == 'worker':
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            print("OPENAI_API_KEY is required. Exiting.")
+            return
+        processes = [
+            multiprocessing.Process(target=_worker_process, args=(
+                args.queue, api_key, f"{default_worker_id()}-{i}", args.batch_size,
+                args.visibility_timeout, args.max_attempts, args.compact, args.idle_timeout))
+            for i in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == 'merge':
+        queue = open_queue(args.queue, max_attempts=args.max_attempts)
+        analyzed_df = merge_queue_results(queue, args.run_id, rollup_store=RollupStore())
+        generate_summary(analyzed_df)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # With arguments, run the queue coordinator/worker/merger; without, the interactive flow
+    if len(sys.argv) > 1:
+        queue_main(sys.argv[1:])
+    else:
+        main()
\ No newline at end of file
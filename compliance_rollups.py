@@ -0,0 +1,271 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from analysis_scheduler import split_categories
+
+# Columns that identify one checklist answer across result files
+FINGERPRINT_COLUMNS = ['location_name', 'checklist_name', 'question', 'answer_date', 'upload_links']
+
+class RollupStore:
+    """
+    Materialized per-day compliance counts kept in a SQLite file.
+
+    Counts are kept per day, location, category, compliance status and severity, with tag
+    counts alongside. Every answer is remembered by a fingerprint, so re-analyzing an answer
+    replaces its earlier contribution instead of counting it twice.
+    """
+
+    def __init__(self, path="compliance_rollups.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                fingerprint TEXT PRIMARY KEY,
+                day TEXT, location_name TEXT, checklist_type TEXT,
+                categories TEXT, compliance_status TEXT, severity_level TEXT, tags TEXT
+            );
+            CREATE TABLE IF NOT EXISTS daily_location (
+                day TEXT, location_name TEXT, checklist_type TEXT,
+                compliance_status TEXT, severity_level TEXT, count INTEGER NOT NULL,
+                PRIMARY KEY (day, location_name, checklist_type, compliance_status, severity_level)
+            );
+            CREATE TABLE IF NOT EXISTS daily_category (
+                day TEXT, location_name TEXT, category TEXT,
+                compliance_status TEXT, severity_level TEXT, count INTEGER NOT NULL,
+                PRIMARY KEY (day, location_name, category, compliance_status, severity_level)
+            );
+            CREATE TABLE IF NOT EXISTS daily_tags (
+                day TEXT, location_name TEXT, tag TEXT, count INTEGER NOT NULL,
+                PRIMARY KEY (day, location_name, tag)
+            );
+            CREATE TABLE IF NOT EXISTS ingested_files (
+                path TEXT PRIMARY KEY, modified REAL, rows INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS daily_location_by_location ON daily_location (location_name, day);
+            CREATE INDEX IF NOT EXISTS daily_tags_by_location ON daily_tags (location_name, day);
+        """)
+
+    def _prepare(self, results_df):
+        """Reduce analyzed rows to the fields the rollups need"""
+        analyzed = results_df[results_df['compliance_status'].notna()]
+        if analyzed.empty:
+            return None
+        keys = analyzed.reindex(columns=FINGERPRINT_COLUMNS).astype(str)
+        missing = pd.Series(pd.NaT, index=analyzed.index)
+        answer_day = pd.to_datetime(analyzed.get('answer_date', missing), errors='coerce')
+        analysis_day = pd.to_datetime(analyzed.get('analysis_date', missing), errors='coerce')
+        # Trends follow the day the answer was submitted, falling back to the analysis day
+        day = answer_day.fillna(analysis_day).dt.strftime('%Y-%m-%d').fillna(datetime.date.today().isoformat())
+        tags = analyzed['analysis_tags'].fillna('').astype(str).str.split(',').apply(
+            lambda parts: sorted({part.strip() for part in parts if part.strip()}))
+        return pd.DataFrame({
+            'fingerprint': pd.util.hash_pandas_object(keys, index=False).astype(str),
+            'day': day,
+            'location_name': analyzed['location_name'].astype(str),
+            'checklist_type': analyzed['checklist_type'].astype(str),
+            'categories': split_categories(analyzed['categorization']).apply(lambda cats: cats or ['Uncategorized']),
+            'compliance_status': analyzed['compliance_status'].astype(str),
+            'severity_level': analyzed['severity_level'].astype(object).fillna('Unknown').astype(str),
+            'tags': tags,
+        }).drop_duplicates('fingerprint', keep='last')
+
+    @staticmethod
+    def _apply(conn, answers, sign):
+        """Add (sign=1) or remove (sign=-1) the contribution of answers to the count tables"""
+        location_counts = answers.groupby(
+            ['day', 'location_name', 'checklist_type', 'compliance_status', 'severity_level']).size()
+        conn.executemany(
+            "INSERT INTO daily_location VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET count = count + excluded.count",
+            [(*key, sign * int(count)) for key, count in location_counts.items()])
+
+        by_category = answers.explode('categories')
+        category_counts = by_category.groupby(
+            ['day', 'location_name', 'categories', 'compliance_status', 'severity_level']).size()
+        conn.executemany(
+            "INSERT INTO daily_category VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET count = count + excluded.count",
+            [(*key, sign * int(count)) for key, count in category_counts.items()])
+
+        by_tag = answers.explode('tags').dropna(subset=['tags'])
+        tag_counts = by_tag.groupby(['day', 'location_name', 'tags']).size()
+        conn.executemany(
+            "INSERT INTO daily_tags VALUES (?, ?, ?, ?) "
+            "ON CONFLICT DO UPDATE SET count = count + excluded.count",
+            [(*key, sign * int(count)) for key, count in tag_counts.items()])
+
+    def add_results(self, results_df):
+        """
+        Fold analyzed rows into the rollups. Rows without a compliance_status are ignored.
+
+        Returns:
+            int: Number of answers added or updated
+        """
+        answers = self._prepare(results_df)
+        if answers is None:
+            return 0
+        with self._lock, self._conn:
+            conn = self._conn
+            fingerprints = answers['fingerprint'].tolist()
+            previous = []
+            for start in range(0, len(fingerprints), 500):
+                chunk = fingerprints[start:start + 500]
+                previous.extend(conn.execute(
+                    f"SELECT * FROM answers WHERE fingerprint IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+            if previous:
+                previous = pd.DataFrame(previous, columns=answers.columns)
+                previous['categories'] = previous['categories'].apply(json.loads)
+                previous['tags'] = previous['tags'].apply(json.loads)
+                self._apply(conn, previous, -1)
+            self._apply(conn, answers, 1)
+            conn.executemany(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row.fingerprint, row.day, row.location_name, row.checklist_type, json.dumps(row.categories),
+                  row.compliance_status, row.severity_level, json.dumps(row.tags))
+                 for row in answers.itertuples(index=False)])
+            # Drop rows whose counts went to zero after a replacement
+            for table in ('daily_location', 'daily_category', 'daily_tags'):
+                conn.execute(f"DELETE FROM {table} WHERE count <= 0")
+        return len(answers)
+
+    def ingest_result_files(self, pattern="location_analysis_*.xlsx"):
+        """Backfill from earlier result workbooks, skipping files already ingested unchanged"""
+        total = 0
+        for path in sorted(glob.glob(pattern)):
+            modified = os.path.getmtime(path)
+            with self._lock:
+                seen = self._conn.execute(
+                    "SELECT modified FROM ingested_files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+            if seen is not None and seen[0] == modified:
+                continue
+            try:
+                rows = self.add_results(pd.read_excel(path))
+            except Exception as e:
+                print(f"Could not ingest {path}: {e}")
+                continue
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?)",
+                                   (os.path.abspath(path), modified, rows))
+            print(f"Ingested {rows} analyzed answers from {path}")
+            total += rows
+        return total
+
+    def _query(self, sql, params):
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    @staticmethod
+    def _since(days, end=None):
+        end = end or datetime.date.today()
+        return (end - datetime.timedelta(days=days - 1)).isoformat(), end.isoformat()
+
+    def compliance_trend(self, location_name, days=90, end=None):
+        """
+        Daily compliance for one location over the last `days` days.
+
+        Returns:
+            pd.DataFrame: Indexed by day with total, yes, no, undetermined, critical and
+                compliance_rate (Yes / (Yes + No)) columns
+        """
+        start, stop = self._since(days, end)
+        trend = self._query("""
+            SELECT day,
+                   SUM(count) AS total,
+                   SUM(CASE WHEN compliance_status = 'Yes' THEN count ELSE 0 END) AS yes,
+                   SUM(CASE WHEN compliance_status = 'No' THEN count ELSE 0 END) AS no,
+                   SUM(CASE WHEN compliance_status NOT IN ('Yes', 'No') THEN count ELSE 0 END) AS undetermined,
+                   SUM(CASE WHEN severity_level = 'Critical' THEN count ELSE 0 END) AS critical
+            FROM daily_location
+            WHERE location_name = ? AND day BETWEEN ? AND ?
+            GROUP BY day ORDER BY day
+        """, (location_name, start, stop)).set_index('day')
+        determinate = trend['yes'] + trend['no']
+        trend['compliance_rate'] = (trend['yes'] / determinate.where(determinate > 0)).round(3)
+        return trend
+
+    def category_breakdown(self, location_name=None, days=90, end=None):
+        """Counts by category and compliance status over the last `days` days"""
+        start, stop = self._since(days, end)
+        sql = "SELECT category, compliance_status, SUM(count) AS count FROM daily_category WHERE day BETWEEN ? AND ?"
+        params = [start, stop]
+        if location_name is not None:
+            sql += " AND location_name = ?"
+            params.append(location_name)
+        counts = self._query(sql + " GROUP BY category, compliance_status", params)
+        return counts.pivot(index='category', columns='compliance_status', values='count').fillna(0).astype(int)
+
+    def severity_counts(self, location_name=None, days=90, end=None):
+        """Counts by severity level over the last `days` days"""
+        start, stop = self._since(days, end)
+        sql = "SELECT severity_level, SUM(count) AS count FROM daily_location WHERE day BETWEEN ? AND ?"
+        params = [start, stop]
+        if location_name is not None:
+            sql += " AND location_name = ?"
+            params.append(location_name)
+        return self._query(sql + " GROUP BY severity_level ORDER BY count DESC", params).set_index('severity_level')['count']
+
+    def top_tags(self, location_name=None, days=90, n=10, end=None):
+        """Most frequent analysis tags over the last `days` days"""
+        start, stop = self._since(days, end)
+        sql = "SELECT tag, SUM(count) AS count FROM daily_tags WHERE day BETWEEN ? AND ?"
+        params = [start, stop]
+        if location_name is not None:
+            sql += " AND location_name = ?"
+            params.append(location_name)
+        return self._query(sql + " GROUP BY tag ORDER BY count DESC LIMIT ?", params + [n]).set_index('tag')['count']
+
+    def critical_share(self):
+        """Share of answers rated Critical per category, over all days"""
+        shares = self._query("""
+            SELECT category,
+                   SUM(CASE WHEN severity_level = 'Critical' THEN count ELSE 0 END) * 1.0 / SUM(count) AS share
+            FROM daily_category
+            GROUP BY category
+        """, ())
+        return shares.set_index('category')['share']
+
+    def locations(self):
+        return self._query("SELECT DISTINCT location_name FROM daily_location ORDER BY location_name", ())['location_name'].tolist()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compliance trend rollups")
+    parser.add_argument('--db', default="compliance_rollups.db")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backfill = commands.add_parser('backfill', help="Ingest earlier location_analysis_*.xlsx files")
+    backfill.add_argument('--pattern', default="location_analysis_*.xlsx")
+
+    trend = commands.add_parser('trend', help="Daily compliance trend for a location")
+    trend.add_argument('location')
+    trend.add_argument('--days', type=int, default=90)
+    trend.add_argument('--end', type=datetime.date.fromisoformat, default=None, help="Last day (YYYY-MM-DD)")
+
+    commands.add_parser('locations', help="List locations with rollup data")
+
+    args = parser.parse_args()
+    store = RollupStore(args.db)
+
+    if args.command == 'backfill':
+        print(f"Ingested {store.ingest_result_files(args.pattern)} answers")
+    elif args.command == 'locations':
+        for location in store.locations():
+            print(location)
+    elif args.command == 'trend':
+        print(f"\n{args.location}: last {args.days} days")
+        print(store.compliance_trend(args.location, args.days, args.end).to_string())
+        print("\nSeverity levels:")
+        print(store.severity_counts(args.location, args.days, args.end).to_string())
+        print("\nTop 10 Tags:")
+        print(store.top_tags(args.location, args.days, end=args.end).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from typing import Callable
+
+import pandas as pd
+
+from analysis_records import AnalysisRecord
+
+# Phrase marking questions where a blank photo is an acceptable answer
+BLANK_PHOTO_PHRASE = "Please click a blank photo if not applicable"
+
+# Upload extensions that are never images
+NON_IMAGE_EXTENSIONS = ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'csv', 'txt', 'zip', 'mp4', 'mov', 'avi', 'mp3', 'wav']
+
+# Image URLs the model can be sent
+VALID_URL_PATTERN = r'^https?://\S+$'
+
+# Hosts the model can't fetch images from (loopback, private networks, local names)
+UNREACHABLE_HOST_PATTERN = (r'^(?:localhost|127\.\d+\.\d+\.\d+|0\.0\.0\.0|10\.\d+\.\d+\.\d+|192\.168\.\d+\.\d+'
+                            r'|172\.(?:1[6-9]|2\d|3[01])\.\d+\.\d+|[\w.-]+\.(?:local|internal|lan))$')
+
+@dataclass(frozen=True)
+class RowRule:
+    """
+    One entry of a pre-classification rule table.
+
+    Args:
+        name (str): Short name shown in the report
+        matches (callable): Takes the DataFrame and returns a boolean mask of matching rows
+        result (callable): Takes the question text and returns the result dict for a matching row
+    """
+    name: str
+    matches: Callable
+    result: Callable
+
+def _column(df, name, default=''):
+    return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+def _flag(df, name):
+    return pd.to_numeric(_column(df, name, 0), errors='coerce').eq(1)
+
+def has_link(df):
+    links = _column(df, 'upload_links', None)
+    return links.notna() & links.astype(str).str.strip('"\' ').ne('')
+
+def image_urls(df):
+    """
+    Vectorized get_image_url: the first URL of a JSON list, the 'url' of a JSON object,
+    or the cleaned value itself. NaN where there is no link.
+    """
+    links = _column(df, 'upload_links', None).where(has_link(df)).astype(object)
+    cleaned = links.dropna().astype(str).str.strip('"\'')
+    from_list = cleaned.str.extract(r'^\[\s*"([^"]*)"', expand=False)
+    from_dict = cleaned.str.extract(r'^\{.*"url"\s*:\s*"([^"]*)"', expand=False)
+    return from_list.fillna(from_dict).fillna(cleaned).reindex(df.index)
+
+def is_skipped(df):
+    return _flag(df, 'is_skipped')
+
+def missing_mandatory_upload(df):
+    return _flag(df, 'is_upload_mandatory') & ~has_link(df)
+
+def invalid_url(df):
+    return has_link(df) & ~image_urls(df).str.match(VALID_URL_PATTERN, na=False)
+
+def non_image_link(df):
+    extension = image_urls(df).str.extract(r'\.([A-Za-z0-9]+)(?:[?#].*)?$', expand=False).str.lower()
+    return extension.isin(NON_IMAGE_EXTENSIONS)
+
+def unreachable_host(df):
+    host = image_urls(df).str.extract(r'^[A-Za-z][A-Za-z0-9+.-]*://(?:[^@/]*@)?([^/:?#]+)', expand=False)
+    return host.str.lower().str.match(UNREACHABLE_HOST_PATTERN, na=False)
+
+def blank_photo_allowed(df):
+    return has_link(df) & _column(df, 'question').astype(str).str.contains(BLANK_PHOTO_PHRASE, regex=False)
+
+def classify_rows(df, rules):
+    """
+    Apply a rule table to every row at once. Rules are tried in order and the
+    first matching rule resolves a row.
+
+    Returns:
+        pd.Series: Name of the rule that resolved each row, NaN for unresolved rows
+    """
+    resolved_by = pd.Series(pd.NA, index=df.index, dtype=object)
+    for rule in rules:
+        mask = rule.matches(df).fillna(False).astype(bool) & resolved_by.isna()
+        resolved_by[mask] = rule.name
+    return resolved_by
+
+def rule_records(df, resolved_by, rules):
+    """Build the AnalysisRecord of every resolved row, keyed by row index"""
+    records = {}
+    for rule in rules:
+        questions = df.loc[resolved_by.eq(rule.name).fillna(False), 'question'].fillna('').astype(str)
+        # Results only depend on the question text, so each distinct question is built once
+        built = {question: AnalysisRecord.from_result(rule.result(question)) for question in questions.unique()}
+        records.update(zip(questions.index, questions.map(built)))
+    return records
+
+def print_rule_report(resolved_by, rules):
+    counts = resolved_by.value_counts()
+    print("\nRows resolved by rules before analysis:")
+    for rule in rules:
+        print(f"  {rule.name}: {int(counts.get(rule.name, 0))}")
+    print(f"  Total resolved: {int(resolved_by.notna().sum())} of {len(resolved_by)}")
@@ -0,0 +1,188 @@
+import json
+import math
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+from analysis_scheduler import INPUT_TOKEN_PRICE, OUTPUT_TOKEN_PRICE
+
+# Image size assumed when an image can't be probed (a typical phone photo)
+DEFAULT_IMAGE_SIZE = (4032, 3024)
+
+# Typical completion length and model latency per call, by output mode
+EXPECTED_OUTPUT_TOKENS = {False: 250, True: 80}
+EXPECTED_CALL_SECONDS = {False: 6.0, True: 3.0}
+
+# Per-request overhead of the chat message format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 10
+
+# Bytes read from the start of an image to find its dimensions
+PROBE_BYTES = 64 * 1024
+
+def image_tokens(width, height):
+    """
+    Input tokens GPT-4o bills for an image at the default (high) detail level:
+    the image is fit within 2048x2048, its short side scaled to 768px, and
+    billed at 170 tokens per 512px tile plus 85 base tokens.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def text_tokens(text):
+    """Approximate token count of English prompt text (about 4 characters per token)"""
+    return math.ceil(len(text) / 4)
+
+# Most input tokens one image can be billed for: fit within 2048px, short side 768px, 4x2 tiles
+MAX_IMAGE_TOKENS = image_tokens(2048, 768)
+
+def max_call_cost(prompt, max_output_tokens):
+    """Worst-case cost in USD of one call: its prompt, the largest billable image and max_output_tokens of output"""
+    input_tokens = text_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS + MAX_IMAGE_TOKENS
+    return input_tokens * INPUT_TOKEN_PRICE + max_output_tokens * OUTPUT_TOKEN_PRICE
+
+def probe_image(image_url, timeout=5):
+    """
+    Find an image's dimensions without downloading all of it.
+
+    HEAD confirms the URL is reachable; since HEAD carries no dimensions, the first
+    PROBE_BYTES are then requested with a Range header and only the image header is parsed.
+
+    Returns:
+        dict: {'reachable': bool, 'width': int or None, 'height': int or None}
+    """
+    try:
+        head = requests.head(image_url, timeout=timeout, allow_redirects=True)
+        # Some storage hosts reject HEAD, so only treat 404/410 as unreachable
+        if head.status_code in (404, 410):
+            return {'reachable': False, 'width': None, 'height': None}
+        response = requests.get(image_url, headers={'Range': f'bytes=0-{PROBE_BYTES - 1}'},
+                                timeout=timeout, stream=True)
+        response.raise_for_status()
+        content = response.raw.read(PROBE_BYTES, decode_content=True)
+        response.close()
+        width, height = Image.open(BytesIO(content)).size
+        return {'reachable': True, 'width': width, 'height': height}
+    except requests.exceptions.RequestException:
+        return {'reachable': False, 'width': None, 'height': None}
+    except Exception:
+        return {'reachable': True, 'width': None, 'height': None}
+
+class ImageMetadataCache:
+    """Probed image dimensions keyed by URL, kept in a JSON file between runs"""
+
+    def __init__(self, path="image_metadata_cache.json"):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Ignoring unreadable image metadata cache {path}: {e}")
+
+    def get(self, image_url):
+        return self.entries.get(image_url)
+
+    def put(self, image_url, metadata):
+        self.entries[image_url] = metadata
+
+    def save(self):
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(self.entries, f)
+
+@dataclass
+class RunEstimate:
+    """Projected size, cost and duration of an analysis run"""
+    image_rows: int
+    model_calls: int
+    skipped_rows: int
+    probed_images: int
+    unreachable_share: float
+    prompt_tokens: int
+    image_tokens: int
+    output_tokens: int
+    cost: float
+    cost_per_call: float
+    seconds: float
+
+    def report(self):
+        print("\n=== RUN ESTIMATE ===")
+        print(f"Image entries: {self.image_rows}")
+        print(f"Expected model calls: {self.model_calls} "
+              f"({self.skipped_rows} resolved without a call, ~{self.unreachable_share:.0%} of probed images unreachable)")
+        print(f"Estimated input tokens: {self.prompt_tokens + self.image_tokens:,} "
+              f"({self.prompt_tokens:,} prompt, {self.image_tokens:,} image; {self.probed_images} images probed)")
+        print(f"Estimated output tokens: {self.output_tokens:,}")
+        print(f"Estimated cost: ${self.cost:.2f} (~${self.cost_per_call:.4f} per call)")
+        print(f"Estimated wall-clock time: {self.seconds / 60:.1f} minutes")
+
+def estimate_run(jobs, pipeline_config, compact=False, sample_size=50, cache=None, seed=42, skips_model=None):
+    """
+    Estimate the cost and duration of analyzing the given pipeline jobs.
+
+    Prompt tokens come from each job's prompt. Image tokens come from the dimensions of
+    a random sample of up to sample_size images (probed, or read from the cache) and are
+    extrapolated to the rest. Duration assumes the LLM stage is the bottleneck at
+    pipeline_config.llm_workers concurrent calls.
+
+    Args:
+        jobs (list): PipelineJob objects from build_pipeline_jobs
+        pipeline_config (PipelineConfig): Concurrency settings of the planned run
+        compact (bool): Whether the run uses compact structured outputs
+        sample_size (int): Number of images to probe for their dimensions
+        cache (ImageMetadataCache): Optional cache of probed dimensions
+        seed (int): Random seed for the probe sample
+        skips_model (callable): Returns True for a job that is resolved without a model call
+
+    Returns:
+        RunEstimate: The projection
+    """
+    skips_model = skips_model or (lambda job: False)
+    pending = [job for job in jobs if job.result is None and not skips_model(job)]
+    sample = random.Random(seed).sample(pending, min(sample_size, len(pending)))
+
+    to_probe = [job.image_url for job in sample if cache is None or cache.get(job.image_url) is None]
+    with ThreadPoolExecutor(max_workers=max(1, pipeline_config.fetch_workers)) as pool:
+        probed = dict(zip(to_probe, pool.map(probe_image, to_probe)))
+    if cache is not None:
+        for image_url, metadata in probed.items():
+            cache.put(image_url, metadata)
+        cache.save()
+    metadata = [probed.get(job.image_url) or cache.get(job.image_url) for job in sample]
+
+    reachable = [entry for entry in metadata if entry['reachable']]
+    unreachable_share = 1 - len(reachable) / len(metadata) if metadata else 0.0
+    sample_image_tokens = [image_tokens(entry['width'] or DEFAULT_IMAGE_SIZE[0], entry['height'] or DEFAULT_IMAGE_SIZE[1])
+                           for entry in reachable]
+    tokens_per_image = sum(sample_image_tokens) / len(sample_image_tokens) if sample_image_tokens else image_tokens(*DEFAULT_IMAGE_SIZE)
+
+    # Unreachable images fail at download, so they never reach the model
+    model_calls = round(len(pending) * (1 - unreachable_share))
+    prompt_share = model_calls / len(pending) if pending else 0.0
+    prompt_tokens = round(sum(text_tokens(job.prompt) + MESSAGE_OVERHEAD_TOKENS for job in pending) * prompt_share)
+    total_image_tokens = round(model_calls * tokens_per_image)
+    output_tokens = model_calls * EXPECTED_OUTPUT_TOKENS[compact]
+    cost = (prompt_tokens + total_image_tokens) * INPUT_TOKEN_PRICE + output_tokens * OUTPUT_TOKEN_PRICE
+
+    return RunEstimate(
+        image_rows=len(jobs),
+        model_calls=model_calls,
+        skipped_rows=len(jobs) - len(pending),
+        probed_images=len(metadata),
+        unreachable_share=unreachable_share,
+        prompt_tokens=prompt_tokens,
+        image_tokens=total_image_tokens,
+        output_tokens=output_tokens,
+        cost=cost,
+        cost_per_call=cost / model_calls if model_calls else 0.0,
+        seconds=math.ceil(model_calls / max(1, pipeline_config.llm_workers)) * EXPECTED_CALL_SECONDS[compact],
+    )
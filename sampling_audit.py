@@ -0,0 +1,227 @@
+import math
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from analysis_scheduler import split_categories
+
+@dataclass
+class SamplingConfig:
+    """
+    Settings for a sampling audit run.
+
+    Args:
+        confidence (float): Confidence level of the reported intervals
+        target_width (float): Stop sampling a stratum once its interval is narrower than this
+            (full width, as a fraction, so 0.2 means +/- 10 points)
+        initial_samples (int): Rows analyzed per stratum in the first round
+        batch_size (int): Extra rows analyzed per unfinished stratum in each later round
+        max_rounds (int): Upper bound on sampling rounds
+        seed (int): Random seed for the order rows are sampled in
+    """
+    confidence: float = 0.95
+    target_width: float = 0.2
+    initial_samples: int = 5
+    batch_size: int = 5
+    max_rounds: int = 10
+    seed: int = 42
+
+def z_value(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+def primary_category(categorization):
+    """First category of each row, used with location_name to form sampling strata"""
+    return split_categories(categorization).str[0].fillna('Uncategorized')
+
+def wilson_interval(successes, n, z):
+    """Vectorized Wilson score interval; returns (lower, upper), NaN where n is 0"""
+    successes = np.asarray(successes, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = successes / n
+        denominator = 1 + z**2 / n
+        center = (p + z**2 / (2 * n)) / denominator
+        margin = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return center - margin, center + margin
+
+def _finite_population_correction(population, sampled):
+    population = np.asarray(population, dtype=float)
+    sampled = np.asarray(sampled, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fpc = np.sqrt(np.clip((population - sampled) / (population - 1), 0, 1))
+    return np.where(population > 1, fpc, 0.0)
+
+def stratum_estimates(image_df, confidence=0.95):
+    """
+    Compliance rate per (location_name, category) stratum from the rows analyzed so far.
+
+    The compliance rate is Yes / (Yes + No); rows that could not be determined are
+    counted as sampled but do not enter the rate.
+
+    Args:
+        image_df (pd.DataFrame): All image rows in scope, with compliance_status set on sampled rows
+        confidence (float): Confidence level of the interval
+
+    Returns:
+        pd.DataFrame: One row per stratum with population, sampled, determinate, compliant,
+            rate, lower, upper and width columns
+    """
+    z = z_value(confidence)
+    status = image_df['compliance_status'].astype(object)
+    frame = pd.DataFrame({
+        'location_name': image_df['location_name'],
+        'category': primary_category(image_df['categorization']) if 'categorization' in image_df else 'Uncategorized',
+        'sampled': status.notna(),
+        'determinate': status.isin(['Yes', 'No']),
+        'compliant': status.eq('Yes'),
+    })
+    strata = frame.groupby(['location_name', 'category']).agg(
+        population=('sampled', 'size'),
+        sampled=('sampled', 'sum'),
+        determinate=('determinate', 'sum'),
+        compliant=('compliant', 'sum'),
+    )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        strata['rate'] = strata['compliant'] / strata['determinate']
+    lower, upper = wilson_interval(strata['compliant'], strata['determinate'], z)
+    # Shrink the interval when a large part of a small stratum has been sampled
+    fpc = _finite_population_correction(strata['population'], strata['sampled'])
+    strata['lower'] = np.clip(strata['rate'] - (strata['rate'] - lower) * fpc, 0, 1)
+    strata['upper'] = np.clip(strata['rate'] + (upper - strata['rate']) * fpc, 0, 1)
+    strata['width'] = (strata['upper'] - strata['lower']).fillna(1.0)
+    return strata
+
+def location_estimates(strata, confidence=0.95):
+    """
+    Combine stratum estimates into a population-weighted compliance rate per location.
+
+    Uses the stratified estimator with Agresti-Coull variances so strata with all-Yes or
+    all-No samples still contribute uncertainty.
+    """
+    z = z_value(confidence)
+    usable = strata[strata['determinate'] > 0].copy()
+    adjusted = (usable['compliant'] + z**2 / 2) / (usable['determinate'] + z**2)
+    fpc = _finite_population_correction(usable['population'], usable['sampled']) ** 2
+    usable['variance'] = adjusted * (1 - adjusted) / (usable['determinate'] + z**2) * fpc
+
+    rows = []
+    for location, group in strata.groupby(level='location_name'):
+        estimable = usable[usable.index.get_level_values('location_name') == location]
+        weights = estimable['population'] / estimable['population'].sum() if len(estimable) else estimable['population']
+        rate = float((weights * estimable['rate']).sum()) if len(estimable) else math.nan
+        margin = z * math.sqrt(float((weights**2 * estimable['variance']).sum())) if len(estimable) else math.nan
+        rows.append({
+            'location_name': location,
+            'population': int(group['population'].sum()),
+            'sampled': int(group['sampled'].sum()),
+            'determinate': int(group['determinate'].sum()),
+            'rate': rate,
+            'lower': max(0.0, rate - margin) if not math.isnan(rate) else math.nan,
+            'upper': min(1.0, rate + margin) if not math.isnan(rate) else math.nan,
+        })
+    return pd.DataFrame(rows).set_index('location_name')
+
+def run_sampling_audit(image_df, analyze_rows, config=None):
+    """
+    Analyze a stratified, adaptive sample of image rows.
+
+    Each round analyzes a few more rows from every stratum whose interval is still wider
+    than config.target_width, until all strata are narrow enough, exhausted, or
+    config.max_rounds is reached.
+
+    Args:
+        image_df (pd.DataFrame): Image rows in scope
+        analyze_rows (callable): Analyzes a DataFrame of rows and returns {index: AnalysisRecord}
+        config (SamplingConfig): Sampling settings
+
+    Returns:
+        pd.DataFrame: Final stratum estimates
+    """
+    config = config or SamplingConfig()
+    status = pd.Series(pd.NA, index=image_df.index, dtype=object)
+
+    # A random order within each stratum; each round takes the next rows in that order
+    order = pd.DataFrame({
+        'stratum': list(zip(image_df['location_name'], primary_category(image_df['categorization']))),
+    }, index=image_df.index).sample(frac=1, random_state=config.seed)
+    order['position'] = order.groupby('stratum').cumcount()
+    taken = {}
+
+    strata = stratum_estimates(image_df.assign(compliance_status=status), config.confidence)
+    for round_number in range(1, config.max_rounds + 1):
+        open_strata = strata[(strata['width'] > config.target_width) & (strata['sampled'] < strata['population'])]
+        if open_strata.empty:
+            break
+        per_stratum = config.initial_samples if round_number == 1 else config.batch_size
+        open_keys = set(open_strata.index)
+        start = order['stratum'].map(lambda key: taken.get(key, 0))
+        selected = (order['stratum'].map(lambda key: key in open_keys)
+                    & (order['position'] >= start) & (order['position'] < start + per_stratum))
+        batch_index = order.index[selected]
+        if len(batch_index) == 0:
+            break
+        for key in open_keys:
+            taken[key] = taken.get(key, 0) + per_stratum
+
+        print(f"\nSampling round {round_number}: analyzing {len(batch_index)} rows from {len(open_strata)} strata")
+        records = analyze_rows(image_df.loc[batch_index])
+        if not records:
+            # Nothing came back, e.g. the run budget is used up
+            break
+        for idx, record in records.items():
+            status.loc[idx] = record.criteria_met
+        strata = stratum_estimates(image_df.assign(compliance_status=status), config.confidence)
+
+    sampled = int(strata['sampled'].sum())
+    print(f"\nSampling audit analyzed {sampled} of {len(image_df)} image entries "
+          f"({sampled / max(len(image_df), 1):.0%})")
+    return strata
+
+def _error_bar(lower, rate, upper, width=40):
+    if any(math.isnan(value) for value in (lower, rate, upper)):
+        return ' ' * (width + 2)
+    bar = [' '] * (width + 1)
+    for i in range(round(lower * width), round(upper * width) + 1):
+        bar[i] = '-'
+    bar[round(rate * width)] = '|'
+    return '[' + ''.join(bar) + ']'
+
+def generate_sampling_summary(analyzed_df, confidence=0.95, resolved_by=None):
+    """
+    Print per-location compliance estimates with confidence intervals and error bars.
+
+    Args:
+        analyzed_df (pd.DataFrame): Rows of the run, with compliance_status set on analyzed rows
+        confidence (float): Confidence level of the intervals
+        resolved_by (pd.Series): Rule that resolved each row, NaN for rows left to the model.
+            Rule-resolved rows were never part of the audit, so they are left out of the strata.
+    """
+    image_df = analyzed_df[~analyzed_df['upload_links'].isna() & (analyzed_df['upload_links'] != '')]
+    if resolved_by is not None:
+        image_df = image_df[resolved_by.reindex(image_df.index).isna()]
+    if image_df['compliance_status'].notna().sum() == 0:
+        print("No entries were sampled.")
+        return None
+
+    strata = stratum_estimates(image_df, confidence)
+    locations = location_estimates(strata, confidence)
+
+    print(f"\n=== SAMPLING AUDIT SUMMARY ({confidence:.0%} confidence) ===")
+    print(f"Sampled {int(strata['sampled'].sum())} of {int(strata['population'].sum())} image entries")
+    print("\nCompliance rate by location (Yes / (Yes + No)):")
+    for location, row in locations.iterrows():
+        if math.isnan(row['rate']):
+            print(f"\n{location}: no determinate results ({int(row['sampled'])} of {int(row['population'])} sampled)")
+            continue
+        print(f"\n{location}: {row['rate']:.1%} (CI {row['lower']:.1%} - {row['upper']:.1%}), "
+              f"{int(row['sampled'])} of {int(row['population'])} sampled")
+        print(f"  0% {_error_bar(row['lower'], row['rate'], row['upper'])} 100%")
+        for (_, category), stratum in strata.loc[[location]].iterrows():
+            if stratum['determinate'] == 0:
+                print(f"    {category}: no determinate results ({int(stratum['sampled'])} of {int(stratum['population'])} sampled)")
+            else:
+                print(f"    {category}: {stratum['rate']:.1%} ({stratum['lower']:.1%} - {stratum['upper']:.1%}), "
+                      f"{int(stratum['sampled'])} of {int(stratum['population'])} sampled")
+    return locations
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from analysis_service import AnalysisService, StubOpenAI, create_app, stub_http_client
+
+ANSWER = {
+    'question': "Are the kitchen floors and drains clean?",
+    'categorization': "[Hygiene & Cleanliness]",
+    'upload_links': "http://images.local/1.png",
+}
+
+def run_against_stubs(scenario, **service_options):
+    """Start the app on stub model and image clients, run scenario(client, service, gate), return its result"""
+    async def main():
+        gate = asyncio.Event()
+        service_box = {}
+
+        def factory():
+            service_box['service'] = AnalysisService(
+                StubOpenAI(delay=0.01, gate=gate), http_client=stub_http_client(), decode_workers=1, **service_options)
+            return service_box['service']
+
+        app = create_app(factory)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://service") as client:
+                return await scenario(client, service_box['service'], gate)
+
+    return asyncio.run(main())
+
+async def wait_for(condition, timeout=10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out waiting for the service"
+        await asyncio.sleep(0.01)
+
+def test_identical_inflight_requests_share_one_model_call():
+    async def scenario(client, service, gate):
+        requests = [asyncio.ensure_future(client.post("/analyze", json=ANSWER)) for _ in range(5)]
+        # Hold the model call until every request has joined the one in flight
+        await wait_for(lambda: service.counters['coalesced'] == 4)
+        gate.set()
+        responses = await asyncio.gather(*requests)
+        return responses, (await client.get("/stats")).json()
+
+    responses, stats = run_against_stubs(scenario)
+    assert [response.status_code for response in responses] == [200] * 5
+    assert all(response.json()['criteria_met'] == "Yes" for response in responses)
+    assert stats['model_calls'] == 1
+    assert stats['coalesced'] == 4
+
+def test_repeated_request_is_served_from_cache():
+    async def scenario(client, service, gate):
+        gate.set()
+        first = await client.post("/analyze", json=ANSWER)
+        second = await client.post("/analyze", json=ANSWER)
+        return first, second, (await client.get("/stats")).json()
+
+    first, second, stats = run_against_stubs(scenario)
+    assert first.json() == second.json()
+    assert stats['model_calls'] == 1
+    assert stats['cache_hits'] == 1
+
+def test_requests_past_max_pending_are_shed_with_503():
+    async def scenario(client, service, gate):
+        answers = [{**ANSWER, 'upload_links': f"http://images.local/{i}.png"} for i in range(5)]
+        requests = [asyncio.ensure_future(client.post("/analyze", json=answer)) for answer in answers]
+        await wait_for(lambda: service.counters['requests'] == 5 and len(service.inflight) == 2)
+        gate.set()
+        responses = await asyncio.gather(*requests)
+        return responses, (await client.get("/stats")).json()
+
+    responses, stats = run_against_stubs(scenario, max_pending=2)
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 200, 503, 503, 503]
+    assert all(response.headers['Retry-After'] == '1' for response in responses if response.status_code == 503)
+    assert stats['shed'] == 3
+    # Shed requests are left out of the latency percentiles
+    assert stats['latency']['count'] == 2
+    assert stats['latency']['p95_ms'] > 0
+
+def test_malformed_url_gets_the_invalid_url_verdict():
+    async def scenario(client, service, gate):
+        gate.set()
+        return await client.post("/analyze", json={**ANSWER, 'upload_links': "not a url"}), service.counters
+
+    response, counters = run_against_stubs(scenario)
+    assert response.status_code == 200
+    assert response.json()['image_quality_issues'] == ["invalid_url"]
+    assert counters['model_calls'] == 0
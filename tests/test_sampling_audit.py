@@ -0,0 +1,19 @@
+import pandas as pd
+
+from sampling_audit import generate_sampling_summary
+
+def test_summary_leaves_rule_resolved_rows_out_of_the_strata():
+    analyzed_df = pd.DataFrame({
+        'location_name': ["Cafe A"] * 4,
+        'categorization': ["[Hygiene & Cleanliness]"] * 4,
+        'upload_links': [f"https://images.example.com/{i}.png" for i in range(4)],
+        'compliance_status': ["Yes", None, "Unable to determine", "Unable to determine"],
+    })
+    resolved_by = pd.Series([pd.NA, pd.NA, "non-image upload", "blank photo allowed"], dtype=object)
+
+    locations = generate_sampling_summary(analyzed_df, resolved_by=resolved_by)
+
+    row = locations.loc["Cafe A"]
+    assert (row['sampled'], row['population']) == (1, 2)
+    # One Yes out of two rows can't support a narrow interval
+    assert row['lower'] < 0.6
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from work_queue import DEAD, DONE, LEASED, PENDING, RedisJobQueue, SQLiteJobQueue
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def queue(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteJobQueue(str(tmp_path / "queue.db"), max_attempts=2)
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RedisJobQueue(client=fakeredis.FakeRedis(decode_responses=True), name="test", max_attempts=2)
+
+def enqueue_rows(queue, count):
+    run_id = queue.create_run("source.csv", ["Cafe A"], [])
+    queue.enqueue(run_id, [(i, {'question': f"q{i}"}) for i in range(count)])
+    return run_id
+
+def test_lease_hands_out_each_job_once(queue):
+    enqueue_rows(queue, 3)
+    first = queue.lease("w1", batch_size=2)
+    second = queue.lease("w2", batch_size=2)
+    assert [job.payload['question'] for job in first] == ["q0", "q1"]
+    assert [job.payload['question'] for job in second] == ["q2"]
+    assert queue.lease("w3", batch_size=2) == []
+    assert queue.counts()[LEASED] == 3
+
+def test_ack_marks_done_and_stores_result(queue):
+    run_id = enqueue_rows(queue, 1)
+    job, = queue.lease("w1")
+    assert queue.ack(job, {'criteria_met': 'Yes'})
+    assert queue.results(run_id) == [(0, DONE, {'criteria_met': 'Yes'}, None)]
+    # A second ack with the same lease is rejected
+    assert not queue.ack(job, {'criteria_met': 'No'})
+
+def test_expired_lease_is_redelivered(queue):
+    enqueue_rows(queue, 1)
+    job, = queue.lease("w1", visibility_timeout=0.1)
+    time.sleep(0.2)
+    redelivered, = queue.lease("w2", visibility_timeout=60)
+    assert redelivered.row_key == job.row_key
+    assert redelivered.attempts == 2
+    assert redelivered.lease_token != job.lease_token
+
+def test_ack_from_expired_lease_is_rejected(queue):
+    run_id = enqueue_rows(queue, 1)
+    job, = queue.lease("w1", visibility_timeout=0.1)
+    time.sleep(0.2)
+    assert not queue.ack(job, {'criteria_met': 'Yes'})
+    # Also rejected after another worker has taken over the job
+    redelivered, = queue.lease("w2", visibility_timeout=60)
+    assert not queue.ack(job, {'criteria_met': 'Yes'})
+    assert queue.ack(redelivered, {'criteria_met': 'No'})
+    assert queue.results(run_id)[0][2] == {'criteria_met': 'No'}
+
+def test_failed_job_is_retried_then_dead_lettered(queue):
+    run_id = enqueue_rows(queue, 1)
+    job, = queue.lease("w1")
+    assert queue.fail(job, "timeout")
+    assert queue.counts()[PENDING] == 1
+    job, = queue.lease("w1")
+    assert queue.fail(job, "timeout again", {'criteria_met': 'Error'})
+    assert queue.lease("w1") == []
+    assert queue.results(run_id) == [(0, DEAD, {'criteria_met': 'Error'}, "timeout again")]
+
+def test_expired_lease_is_dead_lettered_after_max_attempts(queue):
+    run_id = enqueue_rows(queue, 1)
+    for _ in range(2):
+        assert len(queue.lease("w1", visibility_timeout=0.1)) == 1
+        time.sleep(0.2)
+    assert queue.lease("w1") == []
+    row_key, status, result, error = queue.results(run_id)[0]
+    assert status == DEAD
+    assert error == "lease expired"
+
+def test_counts_track_every_state_change_per_run(queue):
+    run_id = enqueue_rows(queue, 4)
+    other_run = enqueue_rows(queue, 1)
+    acked, failed, expired = queue.lease("w1", batch_size=3, visibility_timeout=0.1)[:3]
+    assert queue.ack(acked, {'criteria_met': 'Yes'})
+    assert queue.fail(failed, "timeout")
+    assert queue.counts(run_id) == {PENDING: 2, LEASED: 1, DONE: 1, DEAD: 0}
+    time.sleep(0.2)
+    # The expired lease is handed out again along with everything still pending
+    assert len(queue.lease("w2", batch_size=10)) == 4
+    assert queue.counts(run_id) == {PENDING: 0, LEASED: 3, DONE: 1, DEAD: 0}
+    assert queue.counts(other_run) == {PENDING: 0, LEASED: 1, DONE: 0, DEAD: 0}
+    assert queue.counts() == {PENDING: 0, LEASED: 4, DONE: 1, DEAD: 0}
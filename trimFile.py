@@ -1,5 +1,101 @@
 import streamlit as st
 import pandas as pd
+import random
+from openpyxl import load_workbook
+
+# Columns used to group rows for stratified sampling
+STRATA_COLUMNS = ['location_name', 'checklist_type']
+
+def iter_excel_rows(uploaded_file):
+    """
+    Stream rows from the first sheet of an .xlsx workbook without loading it into memory.
+
+    Args:
+        uploaded_file: Path or file-like object pointing to an .xlsx workbook
+
+    Returns:
+        tuple: (header list, generator of row tuples)
+    """
+    workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    sheet = workbook.worksheets[0]
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(next(rows, ()))]
+
+    def generate():
+        try:
+            for row in rows:
+                # Skip completely empty rows that openpyxl reports past the data
+                if row is None or all(value is None for value in row):
+                    continue
+                yield row
+        finally:
+            workbook.close()
+
+    return header, generate()
+
+def read_head(uploaded_file, num_rows):
+    """Read only the first num_rows data rows of a workbook"""
+    uploaded_file.seek(0)
+    if uploaded_file.name.lower().endswith('.xls'):
+        # Legacy .xls files are not supported by openpyxl
+        return pd.read_excel(uploaded_file, nrows=num_rows)
+
+    header, rows = iter_excel_rows(uploaded_file)
+    head = []
+    for row in rows:
+        head.append(row)
+        if len(head) >= num_rows:
+            break
+    rows.close()
+    return pd.DataFrame(head, columns=header)
+
+def stratified_sample(uploaded_file, rows_per_stratum, seed=None):
+    """
+    Keep up to rows_per_stratum rows for every location_name/checklist_type pair
+    using reservoir sampling, so the workbook is read in a single pass.
+    """
+    rng = random.Random(seed)
+
+    uploaded_file.seek(0)
+    if uploaded_file.name.lower().endswith('.xls'):
+        df = pd.read_excel(uploaded_file)
+        header, rows = list(df.columns), df.itertuples(index=False, name=None)
+    else:
+        header, rows = iter_excel_rows(uploaded_file)
+
+    missing = [col for col in STRATA_COLUMNS if col not in header]
+    if missing:
+        raise ValueError(f"Missing columns required for stratified sampling: {missing}")
+    key_positions = [header.index(col) for col in STRATA_COLUMNS]
+
+    reservoirs = {}
+    seen = {}
+    for row in rows:
+        key = tuple(row[pos] for pos in key_positions)
+        seen[key] = seen.get(key, 0) + 1
+        reservoir = reservoirs.setdefault(key, [])
+        if len(reservoir) < rows_per_stratum:
+            reservoir.append(row)
+        else:
+            # Replace an existing row with probability rows_per_stratum / seen
+            slot = rng.randrange(seen[key])
+            if slot < rows_per_stratum:
+                reservoir[slot] = row
+
+    sampled = [row for key in reservoirs for row in reservoirs[key]]
+    return pd.DataFrame(sampled, columns=header)
+
+def upload_key(uploaded_file):
+    """Identify an upload across reruns by the id Streamlit gives it, or by its name and size"""
+    return getattr(uploaded_file, 'file_id', None) or getattr(uploaded_file, 'id', None) or (uploaded_file.name, uploaded_file.size)
+
+# Streamlit reruns the whole script on every widget change, so the workbook is only read
+# again when the upload or the extraction settings change. The file itself isn't hashed.
+@st.cache_data(max_entries=8, show_spinner="Reading workbook...")
+def extract_rows(file_key, _uploaded_file, mode, count, seed):
+    if mode == "First N rows":
+        return read_head(_uploaded_file, count)
+    return stratified_sample(_uploaded_file, count, seed=seed)
 
 st.title("Excel File Processor")
 
@@ -8,44 +104,50 @@ uploaded_file = st.file_uploader("Choose an Excel file", type=['xlsx', 'xls'])
 
 if uploaded_file is not None:
     try:
-        # Read the Excel file
-        df = pd.read_excel(uploaded_file)
-        
+        mode = st.radio("Extraction mode:", ["First N rows", "Stratified sample"])
+
+        if mode == "First N rows":
+            # Add input for number of rows
+            num_rows = st.number_input("Select number of rows to include:",
+                                       min_value=1,
+                                       value=100,
+                                       step=1)
+            filtered_df = extract_rows(upload_key(uploaded_file), uploaded_file, mode, int(num_rows), None)
+        else:
+            rows_per_stratum = st.number_input("Rows per location and checklist type:",
+                                               min_value=1,
+                                               value=10,
+                                               step=1)
+            seed = st.number_input("Random seed:", min_value=0, value=42, step=1)
+            filtered_df = extract_rows(upload_key(uploaded_file), uploaded_file, mode, int(rows_per_stratum), int(seed))
+
         # Check if the required column exists
-        st.write(df.columns)
-        # st.write("Select the column you want to filter by:")
-        # column_name = st.selectbox("Column Name:", df.columns)
-        # st.write("distinct values in the column:")
-        # st.write(df[column_name].unique())
-        # st.write("select the value you want to filter by:")
-        # value = st.selectbox("Value:", df[column_name].unique())
-        
-        # Add slider for number of rows
-        max_rows = len(df)
-        num_rows = st.slider("Select number of rows to include:", 
-                           min_value=1, 
-                           max_value=max_rows, 
-                           value=min(100, max_rows))
-        
-        
-            # Filter rows where the column value matches and limit to selected number of rows
-        filtered_df = df.head(num_rows)
-            
+        st.write(filtered_df.columns)
+
             # Display the shape of the filtered dataframe
         st.write(f"Shape of filtered dataframe: {filtered_df.shape}")
-            
+
             # Input for output filename
         output_filename = st.text_input("Enter output filename (without extension):", "filtered_data")
-            
-        if st.button("Save as CSV"):
+        output_format = st.selectbox("Output format:", ["CSV", "Parquet"])
+
+        if st.button(f"Save as {output_format}"):
             if output_filename:
+                if output_format == "CSV":
                     # Save the filtered dataframe as CSV
-                filtered_df.to_csv(f"{output_filename}.csv", index=False)
-                st.success(f"File saved as {output_filename}.csv")
+                    filtered_df.to_csv(f"{output_filename}.csv", index=False)
+                    st.success(f"File saved as {output_filename}.csv")
+                else:
+                    try:
+                        # Mixed-type object columns are written as strings for Parquet
+                        filtered_df.apply(lambda col: col.astype('string') if col.dtype == object else col).to_parquet(f"{output_filename}.parquet", index=False)
+                        st.success(f"File saved as {output_filename}.parquet")
+                    except ImportError:
+                        st.error("Parquet output requires pyarrow. Install it with 'pip install pyarrow'.")
             else:
                 st.error("Please enter a filename")
-    
-            
+
+
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
 else:
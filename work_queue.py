@@ -0,0 +1,387 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+# Job states shared by all queue backends
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+DEAD = 'dead'
+
+@dataclass
+class LeasedJob:
+    """A job handed to a worker until its lease expires"""
+    job_id: str
+    row_key: object
+    payload: dict
+    attempts: int
+    lease_token: str
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+class JobQueue:
+    """
+    Durable queue of checklist rows shared by a coordinator, workers and a merger.
+
+    Workers lease jobs for a visibility timeout. A job whose lease runs out is handed
+    to another worker, and a job that has been attempted max_attempts times without
+    being acknowledged is moved to the dead-letter state.
+    """
+
+    def __init__(self, max_attempts=3):
+        self.max_attempts = max_attempts
+
+    def create_run(self, source_path, selected_cafes, selected_vendors):
+        """Record what a run analyzes and return its run id"""
+        raise NotImplementedError
+
+    def get_run(self, run_id):
+        raise NotImplementedError
+
+    def enqueue(self, run_id, items):
+        """Add (row_key, payload dict) items to the queue"""
+        raise NotImplementedError
+
+    def lease(self, worker_id, batch_size=1, visibility_timeout=600):
+        """Return up to batch_size LeasedJobs"""
+        raise NotImplementedError
+
+    def ack(self, job, result):
+        """Mark a leased job as done with its result; returns False if the lease expired or was lost"""
+        raise NotImplementedError
+
+    def fail(self, job, error, result=None):
+        """Release a leased job for another attempt, or dead-letter it; returns False if the lease expired or was lost"""
+        raise NotImplementedError
+
+    def counts(self, run_id=None):
+        """Return a dict of job counts by state"""
+        raise NotImplementedError
+
+    def results(self, run_id):
+        """Return (row_key, state, result, error) for every job in a run"""
+        raise NotImplementedError
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Queue stored in a local SQLite file. Several processes on one host can share it;
+    leases are taken inside an IMMEDIATE transaction so a job is only handed out once.
+    """
+
+    def __init__(self, path="analysis_queue.db", max_attempts=3):
+        super().__init__(max_attempts)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                created REAL,
+                source_path TEXT,
+                selected_cafes TEXT,
+                selected_vendors TEXT
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                row_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_token TEXT,
+                lease_expires REAL,
+                worker_id TEXT,
+                result TEXT,
+                error TEXT,
+                updated REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires);
+            CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run_id);
+        """)
+
+    def _transaction(self, sql_calls):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = sql_calls(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def create_run(self, source_path, selected_cafes, selected_vendors):
+        run_id = new_run_id()
+        self._transaction(lambda conn: conn.execute(
+            "INSERT INTO runs VALUES (?, ?, ?, ?, ?)",
+            (run_id, time.time(), source_path, json.dumps(list(selected_cafes)), json.dumps(list(selected_vendors)))))
+        return run_id
+
+    def get_run(self, run_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_path, selected_cafes, selected_vendors FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown run id: {run_id}")
+        return {'run_id': run_id, 'source_path': row[0],
+                'selected_cafes': json.loads(row[1]), 'selected_vendors': json.loads(row[2])}
+
+    def enqueue(self, run_id, items):
+        now = time.time()
+        rows = [(run_id, json.dumps(row_key), json.dumps(payload), now) for row_key, payload in items]
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT INTO jobs (run_id, row_key, payload, updated) VALUES (?, ?, ?, ?)", rows))
+        return len(rows)
+
+    def lease(self, worker_id, batch_size=1, visibility_timeout=600):
+        def take(conn):
+            now = time.time()
+            # Expired leases that have used every attempt are dead-lettered rather than retried
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = COALESCE(error, 'lease expired'), updated = ? "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (DEAD, now, LEASED, now, self.max_attempts))
+            candidates = conn.execute(
+                "SELECT job_id, row_key, payload, attempts FROM jobs "
+                "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY job_id LIMIT ?",
+                (PENDING, LEASED, now, batch_size)).fetchall()
+            leased = []
+            for job_id, row_key, payload, attempts in candidates:
+                token = uuid.uuid4().hex
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_token = ?, "
+                    "lease_expires = ?, worker_id = ?, updated = ? WHERE job_id = ?",
+                    (LEASED, token, now + visibility_timeout, worker_id, now, job_id))
+                leased.append(LeasedJob(str(job_id), json.loads(row_key), json.loads(payload), attempts + 1, token))
+            return leased
+        return self._transaction(take)
+
+    def ack(self, job, result):
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_token = NULL, updated = ? "
+            "WHERE job_id = ? AND lease_token = ? AND lease_expires >= ?",
+            (DONE, json.dumps(result), time.time(), int(job.job_id), job.lease_token, time.time())).rowcount == 1)
+
+    def fail(self, job, error, result=None):
+        status = DEAD if job.attempts >= self.max_attempts else PENDING
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, lease_token = NULL, updated = ? "
+            "WHERE job_id = ? AND lease_token = ? AND lease_expires >= ?",
+            (status, json.dumps(result) if result is not None else None, str(error), time.time(),
+             int(job.job_id), job.lease_token, time.time())).rowcount == 1)
+
+    def counts(self, run_id=None):
+        query = "SELECT status, COUNT(*) FROM jobs"
+        params = ()
+        if run_id is not None:
+            query += " WHERE run_id = ?"
+            params = (run_id,)
+        with self._lock:
+            rows = self._conn.execute(query + " GROUP BY status", params).fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results(self, run_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_key, status, result, error FROM jobs WHERE run_id = ? ORDER BY job_id", (run_id,)).fetchall()
+        return [(json.loads(row_key), status, json.loads(result) if result else None, error)
+                for row_key, status, result, error in rows]
+
+# Lease, ack and fail each run as one Lua script, so a worker dying part-way can't leave
+# a job in neither the pending list nor the lease set, and an ack can't overwrite a job
+# that was re-leased after its token was checked. Job hashes are at <name>:job:<id>.
+# Every state change also updates the job counts of its run (<name>:run:<id>:counts)
+# and the all-time done/dead counts (<name>:counts), so counts() never scans the jobs.
+_MOVE_FUNCTION = """
+local function move(prefix, key, to)
+    local from = redis.call('HGET', key, 'status')
+    local run_counts = prefix .. ':run:' .. redis.call('HGET', key, 'run_id') .. ':counts'
+    redis.call('HINCRBY', run_counts, from, -1)
+    redis.call('HINCRBY', run_counts, to, 1)
+    if to == 'done' or to == 'dead' then redis.call('HINCRBY', prefix .. ':counts', to, 1) end
+    redis.call('HSET', key, 'status', to)
+end
+"""
+
+_LEASE_SCRIPT = _MOVE_FUNCTION + """
+local pending, leases, prefix = KEYS[1], KEYS[2], ARGV[1]
+local now, expires, batch_size = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local worker_id, max_attempts, token = ARGV[5], tonumber(ARGV[6]), ARGV[7]
+-- Expired leases go back to pending, or to the dead-letter state once every attempt is used
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', leases, 0, now)) do
+    redis.call('ZREM', leases, job_id)
+    local key = prefix .. ':job:' .. job_id
+    redis.call('HSET', key, 'error', 'lease expired', 'lease_token', '')
+    if tonumber(redis.call('HGET', key, 'attempts') or '0') >= max_attempts then
+        move(prefix, key, 'dead')
+    else
+        move(prefix, key, 'pending')
+        redis.call('RPUSH', pending, job_id)
+    end
+end
+local leased = {}
+for i = 1, batch_size do
+    local job_id = redis.call('LPOP', pending)
+    if not job_id then break end
+    local key = prefix .. ':job:' .. job_id
+    local attempts = redis.call('HINCRBY', key, 'attempts', 1)
+    local job_token = token .. ':' .. i
+    move(prefix, key, 'leased')
+    redis.call('HSET', key, 'lease_token', job_token, 'worker_id', worker_id)
+    redis.call('ZADD', leases, expires, job_id)
+    local fields = redis.call('HMGET', key, 'row_key', 'payload')
+    table.insert(leased, {job_id, fields[1], fields[2], attempts, job_token})
+end
+return leased
+"""
+
+_ACK_SCRIPT = _MOVE_FUNCTION + """
+if redis.call('HGET', KEYS[1], 'lease_token') ~= ARGV[2] then return 0 end
+local expires = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if not expires or tonumber(expires) < tonumber(ARGV[4]) then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'result', ARGV[3], 'error', '', 'lease_token', '')
+move(ARGV[5], KEYS[1], 'done')
+return 1
+"""
+
+_FAIL_SCRIPT = _MOVE_FUNCTION + """
+if redis.call('HGET', KEYS[1], 'lease_token') ~= ARGV[2] then return 0 end
+local expires = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if not expires or tonumber(expires) < tonumber(ARGV[6]) then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+local status = 'pending'
+if tonumber(redis.call('HGET', KEYS[1], 'attempts') or '0') >= tonumber(ARGV[5]) then status = 'dead' end
+redis.call('HSET', KEYS[1], 'error', ARGV[3], 'lease_token', '')
+if ARGV[4] ~= '' then redis.call('HSET', KEYS[1], 'result', ARGV[4]) end
+move(ARGV[7], KEYS[1], status)
+if status == 'pending' then redis.call('RPUSH', KEYS[3], ARGV[1]) end
+return 1
+"""
+
+class RedisJobQueue(JobQueue):
+    """
+    Queue stored in Redis, for workers spread over several hosts.
+
+    Args:
+        client: A redis.Redis-compatible client created with decode_responses=True. Any
+            compatible stand-in with Lua scripting (for example fakeredis.FakeRedis with
+            the 'lupa' package) works for local runs.
+        url (str): Redis URL used when no client is given (requires the 'redis' package)
+        name (str): Key prefix for this queue
+    """
+
+    def __init__(self, client=None, url="redis://localhost:6379/0", name="checklist_analysis", max_attempts=3):
+        super().__init__(max_attempts)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("RedisJobQueue requires the 'redis' package. Install it with 'pip install redis'.")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.name = name
+        self._lease_script = client.register_script(_LEASE_SCRIPT)
+        self._ack_script = client.register_script(_ACK_SCRIPT)
+        self._fail_script = client.register_script(_FAIL_SCRIPT)
+
+    def _key(self, *parts):
+        return ":".join((self.name,) + tuple(str(part) for part in parts))
+
+    def create_run(self, source_path, selected_cafes, selected_vendors):
+        run_id = new_run_id()
+        self.redis.hset(self._key('run', run_id, 'meta'), mapping={
+            'source_path': source_path,
+            'selected_cafes': json.dumps(list(selected_cafes)),
+            'selected_vendors': json.dumps(list(selected_vendors)),
+            'created': time.time(),
+        })
+        return run_id
+
+    def get_run(self, run_id):
+        meta = self.redis.hgetall(self._key('run', run_id, 'meta'))
+        if not meta:
+            raise KeyError(f"Unknown run id: {run_id}")
+        return {'run_id': run_id, 'source_path': meta['source_path'],
+                'selected_cafes': json.loads(meta['selected_cafes']),
+                'selected_vendors': json.loads(meta['selected_vendors'])}
+
+    def enqueue(self, run_id, items):
+        count = 0
+        pipe = self.redis.pipeline()
+        for row_key, payload in items:
+            job_id = str(self.redis.incr(self._key('next_id')))
+            pipe.hset(self._key('job', job_id), mapping={
+                'run_id': run_id,
+                'row_key': json.dumps(row_key),
+                'payload': json.dumps(payload),
+                'status': PENDING,
+                'attempts': 0,
+            })
+            pipe.sadd(self._key('run', run_id, 'jobs'), job_id)
+            pipe.rpush(self._key('pending'), job_id)
+            count += 1
+        pipe.hincrby(self._key('run', run_id, 'counts'), PENDING, count)
+        pipe.execute()
+        return count
+
+    def lease(self, worker_id, batch_size=1, visibility_timeout=600):
+        now = time.time()
+        rows = self._lease_script(
+            keys=[self._key('pending'), self._key('leases')],
+            args=[self.name, now, now + visibility_timeout, batch_size, worker_id, self.max_attempts, uuid.uuid4().hex])
+        return [LeasedJob(job_id, json.loads(row_key), json.loads(payload), int(attempts), token)
+                for job_id, row_key, payload, attempts, token in rows]
+
+    def ack(self, job, result):
+        return bool(self._ack_script(
+            keys=[self._key('job', job.job_id), self._key('leases')],
+            args=[job.job_id, job.lease_token, json.dumps(result), time.time(), self.name]))
+
+    def fail(self, job, error, result=None):
+        return bool(self._fail_script(
+            keys=[self._key('job', job.job_id), self._key('leases'), self._key('pending')],
+            args=[job.job_id, job.lease_token, str(error), json.dumps(result) if result is not None else '',
+                  self.max_attempts, time.time(), self.name]))
+
+    def counts(self, run_id=None):
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, DEAD: 0}
+        if run_id is not None:
+            counts.update({status: int(count) for status, count in
+                           self.redis.hgetall(self._key('run', run_id, 'counts')).items()})
+            return counts
+        pipe = self.redis.pipeline()
+        pipe.llen(self._key('pending'))
+        pipe.zcard(self._key('leases'))
+        pipe.hmget(self._key('counts'), DONE, DEAD)
+        pending, leased, (done, dead) = pipe.execute()
+        counts.update({PENDING: pending, LEASED: leased, DONE: int(done or 0), DEAD: int(dead or 0)})
+        return counts
+
+    def results(self, run_id):
+        job_ids = sorted(self.redis.smembers(self._key('run', run_id, 'jobs')), key=int)
+        pipe = self.redis.pipeline()
+        for job_id in job_ids:
+            pipe.hgetall(self._key('job', job_id))
+        return [(json.loads(job['row_key']), job['status'],
+                 json.loads(job['result']) if job.get('result') else None, job.get('error') or None)
+                for job in pipe.execute() if job]
+
+def open_queue(spec, max_attempts=3):
+    """Open a queue from a SQLite file path or a redis:// URL"""
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisJobQueue(url=spec, max_attempts=max_attempts)
+    return SQLiteJobQueue(spec, max_attempts=max_attempts)